@@ -0,0 +1,130 @@
+"""
+Ahead-of-time compilation of a source to a native object file or shared
+library, along with a C header declaring its functions:
+
+    python aot.py ../fibonacci.k -o fibonacci.so
+
+The library loads without LLVM, eg. with ctypes:
+
+    library = ctypes.CDLL('./fibonacci.so')
+    library.fibonacci.restype = ctypes.c_double
+    library.fibonacci.argtypes = [ctypes.c_double]
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from llvm.ee import RELOC_PIC, TargetMachine
+
+from context import Context
+from lexer import open_source
+from run import build
+
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+# C types of the arguments and results of compiled functions.
+CTYPES = {'double': 'double', 'i64': 'int64_t', 'i1': 'bool'}
+
+
+def exported(func):
+    """
+    Tell whether func is a definition callable from C: operators and
+    top-level expressions (__toplevel{n}) are not.
+    """
+    return (not func.is_declaration and not func.name.startswith('__') and
+            IDENTIFIER.match(func.name) is not None)
+
+
+def target(module, level, pic=False):
+    """
+    Return a machine for the host generating code at the given optimization
+    level, and make module target it.
+    """
+    kwargs = {'reloc': RELOC_PIC} if pic else {}
+    machine = TargetMachine.new(opt=level, **kwargs)
+
+    module.triple = machine.triple
+    module.data_layout = str(machine.target_data)
+    return machine
+
+
+def header(context, guard):
+    """
+    Return a C header declaring the exported functions of context.module.
+    """
+    guard = re.sub('[^A-Z0-9]', '_', guard.upper()) + '_H'
+    lines = ['#ifndef ' + guard, '#define ' + guard, '',
+             '#include <stdbool.h>', '#include <stdint.h>', '',
+             '#ifdef __cplusplus', 'extern "C" {', '#endif', '']
+
+    for func in context.module.functions:
+        if exported(func):
+            # Argument names may be C keywords or macros, eg. 'int' or
+            # 'bool': only declare their types.
+            result = CTYPES[str(func.type.pointee.return_type)]
+            args = ', '.join(CTYPES[str(arg.type)] for arg in func.args)
+            lines.append('{} {}({});'.format(result, func.name,
+                                             args or 'void'))
+
+    lines += ['', '#ifdef __cplusplus', '}', '#endif', '', '#endif', '']
+    return '\n'.join(lines)
+
+
+def emit(context, path, level=3, library=False):
+    """
+    Write the object code of context.module to path, linked in a shared
+    library if library is true, and its header next to it.
+    """
+    machine = target(context.module, level, pic=library)
+    code = machine.emit_object(context.module)
+
+    if library:
+        directory = tempfile.mkdtemp()
+
+        try:
+            obj = os.path.join(directory, 'module.o')
+
+            with open(obj, 'wb') as f:
+                f.write(code)
+
+            # Extern declarations are usually libm functions.
+            cc = os.environ.get('CC', 'cc')
+            subprocess.check_call([cc, '-shared', '-o', path, obj, '-lm'])
+        finally:
+            shutil.rmtree(directory)
+    else:
+        with open(path, 'wb') as f:
+            f.write(code)
+
+    name = os.path.splitext(path)[0]
+
+    with open(name + '.h', 'w') as f:
+        f.write(header(context, os.path.basename(name)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('-o', dest='output', required=True,
+                        help='output file, a shared library if it ends '
+                             'with .so or .dylib, else an object file')
+    parser.add_argument('-O', dest='level', type=int, default=3,
+                        choices=sorted(Context.levels),
+                        help='optimization level')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes')
+    args = parser.parse_args()
+
+    context = Context(os.path.basename(args.path), level=args.level)
+    build(open_source(args.path), context, args.jobs, entry=exported)
+
+    library = args.output.endswith(('.so', '.dylib'))
+    emit(context, args.output, args.level, library)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,458 @@
-from llvm.core import Builder, Constant, FCMP_ONE, FCMP_ULT, Type
+import collections
+
+from llvm.core import Builder, Constant, FCMP_OLT, FCMP_ONE, FCMP_UGT
+from llvm.core import FCMP_ULT, ICMP_NE, ICMP_SLT, INTR_CEIL, Type
+from llvm.core import CallOrInvokeInstruction
 from llvm.core import Function as Func
 
+from memo import Memo
+
+
+# Entry of Context.functions: a function of Context.module, with what the front
+# end needs to know about it.
+Symbol = collections.namedtuple('Symbol',
+                                'func arity operator precedence types result')
+
+# Operators compiled inline by BinaryOperator.code instead of being called.
+BUILTIN_OPERATORS = ('=', '+', '-', '*', '<')
+
+# Instructions of the builtin arithmetic operators on ints and on doubles.
+ARITHMETIC = {'+': ('add', 'fadd', 'addtmp'),
+              '-': ('sub', 'fsub', 'subtmp'),
+              '*': ('mul', 'fmul', 'multmp')}
+
+# Types of values, from the narrowest. Bools are i1, ints i64 and doubles
+# double. Literals are doubles holding an integer, eg. integral numbers and
+# their sums: they can become ints as well as doubles, and take the type of
+# the operands they are combined with.
+BOOL, LITERAL, INT, DOUBLE = 'bool', 'literal', 'int', 'double'
+RANKS = {BOOL: 0, LITERAL: 1, INT: 2, DOUBLE: 3}
+
+# Names of the types in annotations, eg. def fib(x:int):int
+TYPES = {'bool': BOOL, 'int': INT, 'double': DOUBLE}
+
+
+def join(left, right):
+    """
+    Return the narrowest type holding the values of both types.
+    """
+    return left if RANKS[left] >= RANKS[right] else right
+
+
+def arithmetic(left, right):
+    """
+    Return the type builtin operators compute in, given the types of their
+    operands: bools are added and compared as literals.
+    """
+    type = join(left, right)
+    return LITERAL if type == BOOL else type
+
+
+def llvm_type(type):
+    if type == BOOL:
+        return Type.int(1)
+
+    if type == INT:
+        return Type.int(64)
+
+    return Type.double()
+
+
+def function_type(types, result):
+    """
+    Return the type of a function, eg. double(double, double).
+    """
+    return Type.function(llvm_type(result), [llvm_type(type)
+                                             for type in types], False)
+
+
+def convert(builder, value, source, target):
+    """
+    Convert a value of type source to type target. Doubles are truncated to
+    make ints; ints and doubles are compared with 0 to make bools, NaN being
+    false.
+    """
+    doubles = (LITERAL, DOUBLE)
+
+    if source == target or (source in doubles and target in doubles):
+        return value
+
+    if target in doubles:
+        if source == BOOL:
+            return builder.uitofp(value, Type.double(), 'booltmp')
 
-def create_alloca_block(function, name):
+        return builder.sitofp(value, Type.double(), 'inttmp')
+
+    if target == INT:
+        if source == BOOL:
+            return builder.zext(value, Type.int(64), 'inttmp')
+
+        return builder.fptosi(value, Type.int(64), 'inttmp')
+
+    if source == INT:
+        zero = Constant.int(Type.int(64), 0)
+        return builder.icmp(ICMP_NE, value, zero, 'booltmp')
+
+    zero = Constant.real(Type.double(), 0)
+    return builder.fcmp(FCMP_ONE, value, zero, 'booltmp')
+
+
+def create_alloca_block(function, name, type=DOUBLE):
     entry = function.get_entry_basic_block()
     builder = Builder.new(entry)
     builder.position_at_beginning(entry)
-    return builder.alloca(Type.double(), name=name)
+    return builder.alloca(llvm_type(type), name=name)
+
+
+def lookup(context, name):
+    try:
+        return context.functions[name]
+    except KeyError:
+        raise SyntaxError("unknown function name: '{}'.".format(name))
+
+
+def declare(module, symbol):
+    """
+    Declare the function of a symbol in another module and return the symbol
+    of the declaration.
+    """
+    func = Func.new(module, symbol.func.type.pointee, symbol.func.name)
+    return symbol._replace(func=func)
+
+
+def children(node):
+    """
+    Generate the nodes directly under a node.
+    """
+    for name in node.fields:
+        value = getattr(node, name)
+
+        if isinstance(value, dict):
+            value = value.values()
+        elif not isinstance(value, list):
+            value = [value]
+
+        for child in value:
+            if isinstance(child, (Expression, Function, Prototype)):
+                yield child
+
+
+def assigned(node):
+    """
+    Return the names of the variables assigned with '=' under a node.
+    """
+    names = set()
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+
+        if (isinstance(node, BinaryOperator) and node.operator == '=' and
+                isinstance(node.left, Variable)):
+            names.add(node.left.name)
+
+        stack.extend(children(node))
+
+    return names
+
+
+def invariant(node, variables):
+    """
+    Return whether an expression made of numbers, variables and arithmetic
+    keeps its value while the given variables change.
+    """
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, Number):
+            continue
+
+        elif isinstance(node, Variable):
+            if node.name in variables:
+                return False
+
+        elif isinstance(node, BinaryOperator):
+            if node.operator not in ('+', '-', '*'):
+                return False
+
+            stack += node.left, node.right
+
+        else:
+            return False
+
+    return True
+
+
+def dispatch(context, func):
+    """
+    Return the value to call to reach func. With tiered compilation, this is
+    the current version of the function, loaded from its dispatch pointer.
+    """
+    if context.tiering is None:
+        return func
+
+    return context.tiering.callee(context.builder, func)
+
+
+def call(context, symbol, args, name):
+    """
+    Call the function of a symbol with (value, type) arguments, converted to
+    the types it takes, and return the (value, type) of the result.
+    """
+    builder = context.builder
+    values = [convert(builder, value, type, target)
+              for (value, type), target in zip(args, symbol.types)]
+
+    return (builder.call(dispatch(context, symbol.func), values, name),
+            symbol.result)
+
+
+def generate(context, node):
+    """
+    Generate the code of an expression and return its (value, type), without
+    recursing: the emit generators of the nodes being generated are kept on a
+    stack. Each one yields the expressions it needs the value of, which are
+    sent back, then its own value.
+    """
+    stack = []
+
+    while True:
+        if node.leaf:
+            value = node.code(context)
+        else:
+            stack.append(node.emit(context))
+            value = None
+
+        # Resume the innermost node until it needs another expression.
+        while stack:
+            item = stack[-1].send(value)
+
+            if isinstance(item, Expression):
+                node = item
+                break
+
+            stack.pop()
+            value = item
+        else:
+            return value
+
+
+def generate_tail(context, node):
+    """
+    Generate the code of the body of a function, returning its value from the
+    function. The branches still in tail position are generated in turn from
+    a stack.
+    """
+    builder = context.builder
+    pending = [(builder.basic_block, node)]
+
+    while pending:
+        block, node = pending.pop()
+        builder.position_at_end(block)
+        pending.extend(reversed(node.tail(context)))
+
+
+class Inference(object):
+    """
+    Local type inference of a function body. A variable bound by a var or for
+    expression gets the narrowest type holding its initial value and every
+    value assigned to it; a literal for variable compared with an int bound
+    is an int. Arguments and annotated variables keep their declared type.
+
+    The body is walked like generate does, with the types found so far, until
+    none of them widens: the types of the variables used before an assignment
+    widening them may have been too narrow. Types only widen, so this takes a
+    few walks.
+    """
+
+    def __init__(self, context, args):
+        self.context = context
+        self.bindings = {}  # node key -> name -> type
+        self.scope = {}  # name -> types of its binding
+        self.declared = set()  # (id of types, name)
+        self.widened = False
+
+        arguments = {}
+
+        for name, type in args:
+            self.declare(arguments, name, type)
+            self.scope[name] = arguments
+
+    def run(self, node):
+        """
+        Return the types of the variables bound under a node, as bindings.
+        """
+        self.widened = True
+
+        while self.widened:
+            self.widened = False
+            self.type(node)
+
+        return self.bindings
+
+    def type(self, node):
+        """
+        Return the type of an expression. The infer generators of the nodes
+        yield the expressions they need the type of, then their own type.
+        """
+        stack = []
+
+        while True:
+            if node.leaf:
+                type = node.infer(self)
+            else:
+                stack.append(node.infer(self))
+                type = None
+
+            while stack:
+                item = stack[-1].send(type)
+
+                if isinstance(item, Expression):
+                    node = item
+                    break
+
+                stack.pop()
+                type = item
+            else:
+                return type
+
+    def lookup(self, name):
+        try:
+            return self.scope[name][name]
+        except KeyError:
+            raise SyntaxError("unknown variable name: '{}'.".format(name))
+
+    def widen(self, types, name, type):
+        """
+        Widen the type of a variable, in the types of its binding, to hold
+        values of type. Return its new type.
+        """
+        old = types.get(name)
+
+        if old is None:
+            types[name] = type
+        elif join(old, type) != old:
+            types[name] = join(old, type)
+            self.widened = True
+
+        return types[name]
+
+    def declare(self, types, name, type):
+        """
+        Give a variable a type that assignments do not widen.
+        """
+        types[name] = type
+        self.declared.add((id(types), name))
+
+    def assign(self, name, type):
+        """
+        Return the type of a variable assigned a value of type.
+        """
+        self.lookup(name)
+        types = self.scope[name]
+
+        if (id(types), name) in self.declared:
+            return types[name]
+
+        return self.widen(types, name, type)
 
 
 class Expression(object):
     """
-    Base class for all expression nodes.
+    Base class for all expression nodes. Leaves generate their code with code;
+    the other nodes with emit, driven by generate. Likewise for their types,
+    with infer. The attributes set by the constructor of a node are its
+    fields.
     """
-    pass
+    leaf = False
+    fields = ()
+
+    @property
+    def key(self):
+        """
+        Identify the node while its function is generated, see Inference.
+        """
+        return id(self)
+
+    def code(self, context):
+        return generate(context, self)
+
+    def tail(self, context):
+        """
+        Generate the code of an expression in tail position, returning its
+        value. Calls returned right away are marked as tail calls, and turned
+        into loops by 'tailcallelim' when recursive. So is the accumulator
+        recursion of ints, eg. n + f(n - 1); not that of doubles, whose adds
+        could only be reassociated with fast-math flags.
+        Return the (block, expression) pairs still in tail position, to be
+        generated at the end of their block.
+        """
+        value, type = self.code(context)
+        ret = convert(context.builder, value, type, context.result)
+
+        if ret is value and isinstance(value, CallOrInvokeInstruction):
+            value.tail_call = True
+
+        context.builder.ret(ret)
+        return ()
 
 
 class Number(Expression):
     """
     Expression class for numeric literals like '1.0'.
     """
+    leaf = True
+    fields = ('value',)
+
     def __init__(self, value):
         self.value = value
 
+    @property
+    def type(self):
+        value = float(self.value)
+
+        if value.is_integer() and abs(value) < 2 ** 63:
+            return LITERAL
+
+        return DOUBLE
+
     def code(self, _):
-        return Constant.real(Type.double(), self.value)
+        return Constant.real(Type.double(), self.value), self.type
+
+    def infer(self, _):
+        return self.type
 
 
 class Variable(Expression):
     """
     Expression class for referencing a variable, like 'a'.
     """
+    leaf = True
+    fields = ('name',)
+
     def __init__(self, name):
         self.name = name
 
     def code(self, context):
         try:
-            return context.builder.load(context.scope[self.name], self.name)
+            alloca, type = context.scope[self.name]
         except KeyError:
             raise SyntaxError("unknown variable name: '{}'.".format(self.name))
 
+        return context.builder.load(alloca, self.name), type
+
+    def infer(self, inference):
+        return inference.lookup(self.name)
+
 
 class BinaryOperator(Expression):
     """
     Expression class for a binary operator.
     """
+    fields = ('operator', 'left', 'right')
+
     def __init__(self, operator, left, right):
         self.operator = operator
         self.left = left
@@ -54,38 +462,68 @@ class BinaryOperator(Expression):
     def name(self):
         return 'binary{}'.format(self.operator)
 
-    def code(self, context):
+    def emit(self, context):
+        builder = context.builder
+
         if self.operator == '=':
             if not isinstance(self.left, Variable):
                 raise SyntaxError("Destination of '=' must be a variable.")
 
-            value = self.right.code(context)  # RHS code generation
-            variable = context.scope[self.left.name]  # Look up the name
-            context.builder.store(value, variable)  # Store value, return it
-            return value
+            value, type = yield self.right  # RHS code generation
+            # Look up the name
+            variable, target = context.scope[self.left.name]
+            value = convert(builder, value, type, target)
+            builder.store(value, variable)  # Store value, return it
+            yield value, target
+            return
+
+        left, left_type = yield self.left
+        right, right_type = yield self.right
+
+        if self.operator not in BUILTIN_OPERATORS:
+            symbol = lookup(context, self.name)
+            yield call(context, symbol, [(left, left_type),
+                                         (right, right_type)], 'binop')
+            return
+
+        # Compute in the widest type of the operands.
+        type = arithmetic(left_type, right_type)
+        left = convert(builder, left, left_type, type)
+        right = convert(builder, right, right_type, type)
 
-        left = self.left.code(context)
-        right = self.right.code(context)
+        if self.operator in ARITHMETIC:
+            ints, doubles, name = ARITHMETIC[self.operator]
+            method = getattr(builder, ints if type == INT else doubles)
+            yield method(left, right, name), type
 
-        if self.operator == '+':
-            return context.builder.fadd(left, right, 'addtmp')
+        elif type == INT:
+            yield builder.icmp(ICMP_SLT, left, right, 'cmptmp'), BOOL
 
-        elif self.operator == '-':
-            return context.builder.fsub(left, right, 'subtmp')
+        else:
+            yield builder.fcmp(FCMP_ULT, left, right, 'cmptmp'), BOOL
 
-        elif self.operator == '*':
-            return context.builder.fmul(left, right, 'multmp')
+    def infer(self, inference):
+        if self.operator == '=':
+            if not isinstance(self.left, Variable):
+                raise SyntaxError("Destination of '=' must be a variable.")
 
-        elif self.operator == '<':
-            ret = context.builder.fcmp(FCMP_ULT, left, right, 'cmptmp')
-            # Convert bool 0 or 1 to double 0.0 or 1.0.
-            return context.builder.uitofp(ret, Type.double(), 'booltmp')
+            type = yield self.right
+            yield inference.assign(self.left.name, type)
+            return
+
+        left = yield self.left
+        right = yield self.right
+
+        if self.operator == '<':
+            yield BOOL
+        elif self.operator in BUILTIN_OPERATORS:
+            yield arithmetic(left, right)
         else:
-            func = context.module.get_function_named(self.name)
-            return context.builder.call(func, [left, right], 'binop')
+            yield lookup(inference.context, self.name).result
 
 
 class UnaryOperator(Expression):
+    fields = ('operator', 'operand')
 
     def __init__(self, operator, operand):
         self.operator = operator
@@ -95,92 +533,154 @@ class UnaryOperator(Expression):
     def name(self):
         return 'unary{}'.format(self.operator)
 
-    def code(self, context):
-        operand = self.operand.code(context)
-        func = context.module.get_function_named(self.name)
-        return context.builder.call(func, [operand], 'unop')
+    def emit(self, context):
+        operand = yield self.operand
+        symbol = lookup(context, self.name)
+        yield call(context, symbol, [operand], 'unop')
+
+    def infer(self, inference):
+        yield self.operand
+        yield lookup(inference.context, self.name).result
 
 
 class Call(Expression):
     """
     Expression class for function calls.
     """
+    fields = ('callee', 'args')
+
     def __init__(self, callee, args):
         self.callee = callee
         self.args = args
 
-    def code(self, context):
-        # Look up the name in the global module table.
-        callee = context.module.get_function_named(self.callee)
+    def emit(self, context):
+        # Look up the name in the function table.
+        callee = lookup(context, self.callee)
 
         # Check for argument mismatch error.
-        if len(callee.args) != len(self.args):
+        if callee.arity != len(self.args):
             raise SyntaxError('Incorrect number of arguments passed.')
 
-        args = [arg.code(context) for arg in self.args]
-        return context.builder.call(callee, args, 'calltmp')
+        args = []
+
+        for arg in self.args:
+            args.append((yield arg))
+
+        yield call(context, callee, args, 'calltmp')
+
+    def infer(self, inference):
+        callee = lookup(inference.context, self.callee)
+
+        if callee.arity != len(self.args):
+            raise SyntaxError('Incorrect number of arguments passed.')
+
+        for arg in self.args:
+            yield arg
+
+        yield callee.result
 
 
 class If(Expression):
     """
     Expression class for if / then / else.
     """
+    fields = ('condition', 'then_branch', 'else_branch')
+
     def __init__(self, condition, then_branch, else_branch=None):
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
 
-    def code(self, context):
-        condition = self.condition.code(context)
-        zero = Constant.real(Type.double(), 0)
-        boolean = context.builder.fcmp(FCMP_ONE, condition, zero, 'ifcond')
+    def emit(self, context):
+        builder = context.builder
+        condition, type = yield self.condition
+        boolean = convert(builder, condition, type, BOOL)
 
-        func = context.builder.basic_block.function
+        func = builder.basic_block.function
 
         # Create blocks for the then and else cases. Insert the 'then' block
         # at the end of the function.
         then_block = func.append_basic_block('then')
         else_block = func.append_basic_block('else')
         merge_block = func.append_basic_block('ifcont')
-        context.builder.cbranch(boolean, then_block, else_block)
+        builder.cbranch(boolean, then_block, else_block)
 
         # Emit then value.
-        context.builder.position_at_end(then_block)
-        then_value = self.then_branch.code(context)
-        context.builder.branch(merge_block)
+        builder.position_at_end(then_block)
+        then_value, then_type = yield self.then_branch
 
         # code generation of 'Then' can change the current block; update
-        # then_block or the PHI node.
-        then_block = context.builder.basic_block
+        # then_block for the PHI node. It branches to the merge block once
+        # the type of the else value is known.
+        then_block = builder.basic_block
 
         # Emit else block.
-        context.builder.position_at_end(else_block)
-        else_value = self.else_branch.code(context)
-        context.builder.branch(merge_block)
+        builder.position_at_end(else_block)
+        else_value, else_type = yield self.else_branch
 
         # code generation of 'Else' can change the current block, update
-        # else_block or the PHI node.
-        else_block = context.builder.basic_block
+        # else_block for the PHI node.
+        else_block = builder.basic_block
+
+        # Convert both values to the type of the if, at the end of their
+        # block.
+        type = join(then_type, else_type)
+        incoming = []
+
+        for value, value_type, block in ((then_value, then_type, then_block),
+                                         (else_value, else_type, else_block)):
+            builder.position_at_end(block)
+            incoming.append((convert(builder, value, value_type, type), block))
+            builder.branch(merge_block)
 
         # Emit merge block.
-        context.builder.position_at_end(merge_block)
-        phi = context.builder.phi(Type.double(), 'iftmp')
-        phi.add_incoming(then_value, then_block)
-        phi.add_incoming(else_value, else_block)
-        return phi
+        builder.position_at_end(merge_block)
+        phi = builder.phi(llvm_type(type), 'iftmp')
+
+        for value, block in incoming:
+            phi.add_incoming(value, block)
+
+        yield phi, type
+
+    def infer(self, _):
+        yield self.condition
+        then_type = yield self.then_branch
+        else_type = yield self.else_branch
+        yield join(then_type, else_type)
+
+    def tail(self, context):
+        # Each branch returns its own value instead of merging them: the
+        # calls in the branches are in tail position too.
+        if self.else_branch is None:
+            return super(If, self).tail(context)
+
+        condition, type = self.condition.code(context)
+        boolean = convert(context.builder, condition, type, BOOL)
+
+        func = context.builder.basic_block.function
+        then_block = func.append_basic_block('then')
+        else_block = func.append_basic_block('else')
+        context.builder.cbranch(boolean, then_block, else_block)
+        return (then_block, self.then_branch), (else_block, self.else_branch)
 
 
 class Prototype(object):
     """
     This class represents the "prototype" for a function, which captures its
     name, and its argument names (thus implicitly the number of arguments the
-    function takes), as well as if it is an operator.
+    function takes), as well as if it is an operator. Arguments and results
+    are doubles unless annotated.
     """
-    def __init__(self, name, args, operator=False, precedence=0):
+    fields = ('name', 'args', 'operator', 'precedence', 'types', 'result')
+
+    def __init__(self, name, args, operator=False, precedence=0, types=None,
+                 result=DOUBLE):
         self.name = name
         self.args = args
         self.operator = operator
         self.precedence = precedence
+        self.types = list(types) if types is not None else [DOUBLE] * len(args)
+        self.result = result
 
     @property
     def binaryop(self):
@@ -194,24 +694,51 @@ class Prototype(object):
 
         return self.name[-1]
 
+    @property
+    def signature(self):
+        """
+        The fields of the symbol of the function, but the function.
+        """
+        return (len(self.args), self.operator, self.precedence,
+                tuple(self.types), self.result)
+
+    @property
+    def doubles(self):
+        """
+        Whether the function takes and returns doubles only.
+        """
+        return set(self.types) | {self.result} == {DOUBLE}
+
+    def check(self, symbol):
+        """
+        Raise RuntimeError if symbol declares the function with other
+        arguments.
+        """
+        if symbol.arity != len(self.args):
+            raise RuntimeError('Redeclaration of a function with a '
+                               'different number of args.')
+
+        if (symbol.types, symbol.result) != (tuple(self.types), self.result):
+            raise RuntimeError('Redeclaration of a function with different '
+                               'types.')
+
     def code(self, context):
         # Make the function type, eg. double(double, double).
-        func_args = (Type.double(),) * len(self.args)
-        func_type = Type.function(Type.double(), func_args, False)
+        func_type = function_type(self.types, self.result)
 
-        for func in context.module.functions:
-            if func.name == self.name:
-                if not func.is_declaration:
-                    raise RuntimeError('Redefinition of function.')
+        symbol = context.functions.get(self.name)
 
-                if len(func.args) != len(self.args):
-                    raise RuntimeError('Redeclaration of a function with a '
-                                       'different number of args.')
+        if symbol is not None:
+            func = symbol.func
 
-                break
+            if not func.is_declaration:
+                raise RuntimeError('Redefinition of function.')
+
+            self.check(symbol)
 
         else:
             func = Func.new(context.module, func_type, self.name)
+            context.functions[self.name] = Symbol(func, *self.signature)
 
         for arg, name in zip(func.args, self.args):
             arg.name = name
@@ -222,11 +749,15 @@ class Prototype(object):
 
 class Function(object):
     """
-    This class represents a function definition itself.
+    This class represents a function definition itself, memoized if defined
+    with 'memo def'.
     """
-    def __init__(self, prototype, body):
+    fields = ('prototype', 'body', 'memoized')
+
+    def __init__(self, prototype, body, memoized=False):
         self.prototype = prototype
         self.body = body
+        self.memoized = memoized
 
     def code(self, context):
         context.scope = {}  # Create a new scope
@@ -243,29 +774,60 @@ class Function(object):
         block = func.append_basic_block('entry')
         context.builder = Builder.new(block)
 
-        for name, arg in zip(self.prototype.args, func.args):
-            alloca = create_alloca_block(func, name)
+        args = zip(self.prototype.args, self.prototype.types)
+
+        for (name, type), arg in zip(args, func.args):
+            alloca = create_alloca_block(func, name, type)
             context.builder.store(arg, alloca)
-            context.scope[name] = alloca
+            context.scope[name] = alloca, type
+
+        context.result = self.prototype.result
 
         # Finish off the function.
         try:
-            ret = self.body.code(context)
-            context.builder.ret(ret)
+            with context.phase('code'):
+                context.bindings = Inference(context, args).run(self.body)
+
+                if self.memoized:
+                    if not self.prototype.doubles:
+                        raise SyntaxError('Only functions of doubles can be '
+                                          'memoized.')
+
+                    # The result is stored before returning, no tail calls.
+                    memo = Memo(context, func)
+                    memo.lookup(context)
+
+                    value, type = self.body.code(context)
+                    ret = convert(context.builder, value, type, DOUBLE)
+                    memo.store(context, ret)
+                    context.builder.ret(ret)
+                else:
+                    generate_tail(context, self.body)
 
             # Validate the generated code, checking for consistency.
-            func.verify()
+            with context.phase('verify'):
+                func.verify()
 
             # Optimize the function.
-            context.fpm.run(func)
+            with context.phase('optimize', func):
+                context.fpm.run(func)
         except:
             func.delete()
+            del context.functions[self.prototype.name]
 
             if self.prototype.binaryop:
                 del context.precedence[self.prototype.opname]
 
             raise
 
+        if context.tiering is not None:
+            context.tiering.instrument(self, func)
+
+        profile = context.profile
+
+        if profile is not None and profile.runtime and self.prototype.name:
+            profile.instrument(func)
+
         return func
 
 
@@ -273,6 +835,8 @@ class For(Expression):
     """
     Expression class for for / in.
     """
+    fields = ('variable', 'start', 'end', 'step', 'body')
+
     def __init__(self, variable, start, end, step, body):
         self.variable = variable
         self.start = start
@@ -280,133 +844,193 @@ class For(Expression):
         self.step = step
         self.body = body
 
-    # code function using a PHI node
-
-    # def code(self, context):
-    #     # Emit the start code first, without 'variable' in scope.
-    #     start_value = self.start.code(context)
-
-    #     # Make the new basic block for the loop header, inserting after
-    #     # current block.
-    #     function = context.builder.basic_block.function
-    #     pre_header_block = context.builder.basic_block
-    #     loop_block = function.append_basic_block('loop')
-
-    #     # Insert an explicit fallthrough from the current block to the
-    #     # loop_block.
-    #     context.builder.branch(loop_block)
-
-    #     # Start insertion in loop_block.
-    #     context.builder.position_at_end(loop_block)
-
-    #     # Start the PHI node with an entry for start.
-    #     variable_phi = context.builder.phi(Type.double(), self.variable)
-    #     variable_phi.add_incoming(start_value, pre_header_block)
-
-    #     # Within the loop, the variable is defined equal to the PHI node. If
-    #     # if shadows an existing variable, we have to restore it, so save it
-    #     # now.
-    #     old_value = context.scope.get(self.variable, None)
-    #     context.scope[self.variable] = variable_phi
+    def bound(self):
+        """
+        Return the bound of a loop going on while variable < bound, else None.
+        """
+        end = self.end
+
+        if (isinstance(end, BinaryOperator) and end.operator == '<' and
+                isinstance(end.left, Variable) and
+                end.left.name == self.variable):
+            return end.right
+
+        return None
+
+    def counted(self):
+        """
+        Return whether the loop counts with an integer step from an integer
+        start up to a bound that does not change in the loop, the body not
+        assigning the variable.
+        """
+        step = self.step if self.step is not None else Number(1)
+        bound = self.bound()
+
+        if not (isinstance(self.start, Number) and isinstance(step, Number)):
+            return False
+
+        if bound is None:
+            return False
+
+        # Doubles represent every integer up to 2 ** 53.
+        if not all(value == int(value) and abs(value) < 2 ** 52
+                   for value in (self.start.value, step.value)):
+            return False
+
+        if step.value <= 0:
+            return False
+
+        variables = assigned(self.body)
+
+        if self.variable in variables:
+            return False
+
+        return invariant(bound, variables | {self.variable})
+
+    def emit_counted(self, context):
+        """
+        Generate a counted loop: the variable is derived from an integer
+        induction variable compared with an integer limit computed once, so
+        that the loop passes know its trip count. An int variable is the
+        induction variable itself.
+        """
+        builder = context.builder
+        function = builder.basic_block.function
+        int64 = Type.int(64)
+        double = Type.double()
+
+        type = context.bindings[self.key][self.variable]
+        alloca = create_alloca_block(function, self.variable, type)
+        step = self.step.value if self.step is not None else 1
+
+        bound, bound_type = yield self.bound()
+
+        # The loop goes on while variable < bound, ie. index < ceil(bound).
+        # Unordered comparisons are true: a NaN bound never ends the loop,
+        # nor does a huge one in practice.
+        if bound_type == INT:
+            limit = bound
+        else:
+            ceil = Func.intrinsic(context.module, INTR_CEIL, [double])
+            bound = convert(builder, bound, bound_type, DOUBLE)
+            bound = builder.call(ceil, [bound], 'bound')
+            huge = Constant.real(double, 2.0 ** 62)
+            tiny = Constant.real(double, -2.0 ** 62)
+            bound = builder.select(builder.fcmp(FCMP_UGT, bound, huge), huge,
+                                   bound)
+            bound = builder.select(builder.fcmp(FCMP_OLT, bound, tiny), tiny,
+                                   bound)
+            limit = builder.fptosi(bound, int64, 'limit')
+
+        preheader_block = builder.basic_block
+        loop_block = function.append_basic_block('loop')
+        builder.branch(loop_block)
+        builder.position_at_end(loop_block)
 
-    #     # Emit the body of the loop.  This, like any other expr, can change
-    #     # the current BB.  Note that we ignore the value computed by the body.
-    #     self.body.code(context)
+        index = builder.phi(int64, 'index')
+        index.add_incoming(Constant.int(int64, int(self.start.value)),
+                           preheader_block)
+        builder.store(convert(builder, index, INT, type), alloca)
 
-    #     # Emit the step value.
-    #     if self.step:
-    #         step_value = self.step.code(context)
-    #     else:
-    #         # If not specified, use 1.0.
-    #         step_value = Constant.real(Type.double(), 1)
+        old_value = context.scope.get(self.variable, None)
+        context.scope[self.variable] = alloca, type
 
-    #     next_value = context.builder.fadd(variable_phi, step_value, 'next')
+        yield self.body
 
-    #     # Compute the end condition and convert it to a bool by comparing to
-    #     # 0.0.
-    #     end_condition = self.end.code(context)
-    #     end_condition_bool = context.builder.fcmp(FCMP_ONE, end_condition, Constant.real(Type.double(), 0), 'loopcond')
+        # The index stays far from overflowing, unless an int bound is huge.
+        next_index = builder.add(index, Constant.int(int64, int(step)),
+                                 'nextindex', nsw=bound_type != INT)
+        condition = builder.icmp(ICMP_SLT, index, limit, 'loopcond')
 
-    #     # Create the "after loop" block and insert it.
-    #     loop_end_block = context.builder.basic_block
-    #     after_block = function.append_basic_block('afterloop')
+        loop_end_block = builder.basic_block
+        after_block = function.append_basic_block('afterloop')
+        builder.cbranch(condition, loop_block, after_block)
+        index.add_incoming(next_index, loop_end_block)
 
-    #     # Insert the conditional branch into the end of loop_end_block.
-    #     context.builder.cbranch(end_condition_bool, loop_block, after_block)
+        builder.position_at_end(after_block)
 
-    #     # Any new code will be inserted in after_block.
-    #     context.builder.position_at_end(after_block)
+        if old_value is not None:
+            context.scope[self.variable] = old_value
+        else:
+            del context.scope[self.variable]
 
-    #     # Add a new entry to the PHI node for the backedge.
-    #     variable_phi.add_incoming(next_value, loop_end_block)
+        yield Constant.real(double, 0), LITERAL
 
-    #     # Restore the unshadowed variable.
-    #     if old_value:
-    #         context.scope[self.variable] = old_value
-    #     else:
-    #         del context.scope[self.variable]
+    def emit(self, context):
+        if self.counted():
+            return self.emit_counted(context)
 
-    #     # for expr always returns 0.0.
-    #     return Constant.real(Type.double(), 0)
+        return self.emit_loop(context)
 
-    def code(self, context):
-        function = context.builder.basic_block.function
+    def emit_loop(self, context):
+        builder = context.builder
+        function = builder.basic_block.function
+        type = context.bindings[self.key][self.variable]
 
         # Create an alloca for the variable in the entry block.
-        alloca = create_alloca_block(function, self.variable)
+        alloca = create_alloca_block(function, self.variable, type)
 
         # Emit the start code first, without 'variable' in scope.
-        start_value = self.start.code(context)
+        start_value, start_type = yield self.start
 
         # Store the value into the alloca.
-        context.builder.store(start_value, alloca)
+        builder.store(convert(builder, start_value, start_type, type), alloca)
 
         # Make the new basic block for the loop, inserting after current block.
         loop_block = function.append_basic_block('loop')
 
         # Insert an explicit fall through from the current block to the
         # loop_block.
-        context.builder.branch(loop_block)
+        builder.branch(loop_block)
 
         # Start insertion in loop_block.
-        context.builder.position_at_end(loop_block)
+        builder.position_at_end(loop_block)
 
         # Within the loop, the variable is defined equal to the alloca.  If it
         # shadows an existing variable, we have to restore it, so save it now.
         old_value = context.scope.get(self.variable, None)
-        context.scope[self.variable] = alloca
+        context.scope[self.variable] = alloca, type
 
         # Emit the body of the loop.  This, like any other expr, can change the
         # current BB.  Note that we ignore the value computed by the body.
-        self.body.code(context)
+        yield self.body
 
         # Emit the step value.
         if self.step:
-            step_value = self.step.code(context)
+            step_value, step_type = yield self.step
         else:
             # If not specified, use 1.0.
-            step_value = Constant.real(Type.double(), 1)
+            step_value, step_type = Constant.real(Type.double(), 1), LITERAL
 
         # Compute the end condition.
-        end_condition = self.end.code(context)
+        end_condition, end_type = yield self.end
 
         # Reload, increment, and restore the alloca.  This handles the case
-        # where the body of the loop mutates the variable.
-        cur_value = context.builder.load(alloca, self.variable)
-        next_value = context.builder.fadd(cur_value, step_value, 'nextvar')
-        context.builder.store(next_value, alloca)
+        # where the body of the loop mutates the variable. Inference made the
+        # type of the variable wide enough for the sum.
+        sum_type = arithmetic(type, step_type)
+        cur_value = convert(builder, builder.load(alloca, self.variable), type,
+                            sum_type)
+        step_value = convert(builder, step_value, step_type, sum_type)
+
+        if sum_type == INT:
+            next_value = builder.add(cur_value, step_value, 'nextvar')
+        else:
+            next_value = builder.fadd(cur_value, step_value, 'nextvar')
+
+        builder.store(convert(builder, next_value, sum_type, type), alloca)
 
         # Convert condition to a bool by comparing equal to 0.0.
-        end_condition_bool = context.builder.fcmp(FCMP_ONE, end_condition, Constant.real(Type.double(), 0), 'loopcond')
+        end_condition_bool = convert(builder, end_condition, end_type, BOOL)
 
         # Create the "after loop" block and insert it.
         after_block = function.append_basic_block('afterloop')
 
         # Insert the conditional branch into the end of loop_block.
-        context.builder.cbranch(end_condition_bool, loop_block, after_block)
+        builder.cbranch(end_condition_bool, loop_block, after_block)
 
         # Any new code will be inserted in after_block.
-        context.builder.position_at_end(after_block)
+        builder.position_at_end(after_block)
 
         # Restore the unshadowed variable.
         if old_value is not None:
@@ -415,17 +1039,50 @@ class For(Expression):
             del context.scope[self.variable]
 
         # for expr always returns 0.0.
-        return Constant.real(Type.double(), 0)
+        yield Constant.real(Type.double(), 0), LITERAL
+
+    def infer(self, inference):
+        types = inference.bindings.setdefault(self.key, {})
+        start = yield self.start
+        inference.widen(types, self.variable, start)
+
+        old_types = inference.scope.get(self.variable, None)
+        inference.scope[self.variable] = types
+
+        yield self.body
+        step = (yield self.step) if self.step else LITERAL
+        yield self.end
+
+        type = inference.widen(types, self.variable,
+                               arithmetic(types[self.variable], step))
+
+        # Count up to an int bound with an int.
+        bound = self.bound()
+
+        if type == LITERAL and bound is not None and (yield bound) == INT:
+            inference.widen(types, self.variable, INT)
+
+        if old_types is not None:
+            inference.scope[self.variable] = old_types
+        else:
+            del inference.scope[self.variable]
+
+        yield LITERAL
 
 
 class Var(Expression):
-    def __init__(self, variables, body):
+    fields = ('variables', 'body', 'types')
+
+    def __init__(self, variables, body, types=None):
         self.variables = variables
         self.body = body
+        self.types = types if types is not None else {}  # Annotated ones
 
-    def code(self, context):
+    def emit(self, context):
         old_bindings = {}
-        function = context.builder.basic_block.function
+        builder = context.builder
+        function = builder.basic_block.function
+        types = context.bindings[self.key]
 
         # Register all variables and emit their initializer.
         for name, expression in self.variables.items():
@@ -435,22 +1092,22 @@ class Var(Expression):
             #  var a = 1 in
             #    var a = a in ...   # refers to outer 'a'.
             if expression is not None:
-                value = expression.code(context)
+                value, type = yield expression
             else:
-                value = Constant.real(Type.double(), 0)
+                value, type = Constant.real(Type.double(), 0), LITERAL
 
-            alloca = create_alloca_block(function, name)
-            context.builder.store(value, alloca)
+            alloca = create_alloca_block(function, name, types[name])
+            builder.store(convert(builder, value, type, types[name]), alloca)
 
             # Remember the old variable binding so that we can restore the
             # binding when we unrecurse.
             old_bindings[name] = context.scope.get(name, None)
 
             # Remember this binding.
-            context.scope[name] = alloca
+            context.scope[name] = alloca, types[name]
 
         # Codegen the body, now that all vars are in scope.
-        body = self.body.code(context)
+        body = yield self.body
 
         # Pop all our variables from scope.
         for name in self.variables:
@@ -460,4 +1117,32 @@ class Var(Expression):
                 del context.scope[name]
 
         # Return the body computation.
-        return body
+        yield body
+
+    def infer(self, inference):
+        old_bindings = {}
+        types = inference.bindings.setdefault(self.key, {})
+
+        for name, expression in self.variables.items():
+            if expression is not None:
+                type = yield expression
+            else:
+                type = LITERAL
+
+            if name in self.types:
+                inference.declare(types, name, self.types[name])
+            else:
+                inference.widen(types, name, type)
+
+            old_bindings[name] = inference.scope.get(name, None)
+            inference.scope[name] = types
+
+        body = yield self.body
+
+        for name in self.variables:
+            if old_bindings[name] is not None:
+                inference.scope[name] = old_bindings[name]
+            else:
+                del inference.scope[name]
+
+        yield body
@@ -0,0 +1,898 @@
+"""
+Micro-benchmarks for the compiler stages. Run them from this directory:
+
+    python benchmarks.py NAME [file.k]
+
+where NAME is one of the keys of BENCHMARKS. Without a file, a synthetic
+source is used.
+"""
+import cStringIO
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+from llvm.core import Type
+from llvm.ee import GenericValue
+
+import ast
+from cache import Cache
+from context import Context
+from incremental import Incremental
+from lexer import BufferedLexer, Lexer
+from memo import stats
+from parser import Parser
+from profiler import Profile
+from run import build
+from streaming import stream
+from tiering import Tiering
+from tokens import Char, Identifier, Number
+from vectorize import Vectorized
+
+
+FIBONACCI = """
+def fibonacci(x)
+  if x < 3 then
+    1
+  else
+    fibonacci(x - 1) + fibonacci(x - 2)
+
+fibonacci(32)
+"""
+
+# Growth of the peak RSS allowed per definition streamed, in KB: its machine
+# code and its symbol are kept, its IR and AST are not.
+STREAM_BUDGET = 4
+
+SOAK = """
+def square(x) x * x
+
+square(3) + 1
+
+# Fails in code generation, after square is mapped in the scratch module.
+square(3) + missing(1)
+"""
+
+POLYNOMIAL = """
+def polynomial(x y)
+  x * x * 3 + x * y - y * 2 + 1
+"""
+
+MEMOIZED = """
+memo def fibonacci(x)
+  if x < 3 then
+    1
+  else
+    fibonacci(x - 1) + fibonacci(x - 2)
+
+fibonacci(40)
+"""
+
+COUNTDOWN = """
+def countdown(n acc)
+  if n < 1 then
+    acc
+  else
+    countdown(n - 1, acc + 1)
+
+# Accumulator recursion: only the int version becomes a loop, the adds of
+# doubles are not reassociated.
+def total(n)
+  if n < 1 then
+    0
+  else
+    n + total(n - 1)
+
+def itotal(n:int):int
+  if n < 1 then
+    0
+  else
+    n + itotal(n - 1)
+"""
+
+SUMS = """
+def binary : 1 (x y) y
+
+# Counted loop: integer start and step, bound unchanged by the body.
+def counted(n)
+  var total = 0 in
+    (for i = 0, i < n in
+      total = total + i * i) : total
+
+# Same loop, but its start is only known at run time.
+def generic(n)
+  var total = 0, start = 0 in
+    (for i = start, i < n in
+      total = total + i * i) : total
+"""
+
+LOOP = """
+def increment(x) x + 1
+
+def loop(n)
+  for i = 0, i < n in
+    increment(i)
+"""
+
+# Integer workloads with doubles, then with ints: their i versions.
+TYPED = """
+def binary : 1 (x y) y
+
+def fibonacci(x)
+  if x < 3 then
+    1
+  else
+    fibonacci(x - 1) + fibonacci(x - 2)
+
+def ifibonacci(x:int):int
+  if x < 3 then
+    1
+  else
+    ifibonacci(x - 1) + ifibonacci(x - 2)
+
+def sums(n)
+  var total = 0 in
+    (for i = 0, i < n in
+      total = total + i * i) : total
+
+def isums(n:int):int
+  var total = 0 in
+    (for i = 0, i < n in
+      total = total + i * i) : total
+
+# Pairs i, j below n whose product is below n too.
+def pairs(n)
+  var count = 0 in
+    (for i = 0, i < n in
+      for j = 0, j < n in
+        count = count + (i * j < n)) : count
+
+def ipairs(n:int):int
+  var count:int = 0 in
+    (for i = 0, i < n in
+      for j = 0, j < n in
+        count = count + (i * j < n)) : count
+"""
+
+
+def generate(count):
+    """
+    Generate a source with count function definitions, each calling the
+    previous one.
+    """
+    lines = ['# Generated source.', 'def f0(x y) x + y']
+
+    for i in xrange(1, count):
+        lines.append('def f{}(x y)'.format(i))
+        lines.append('  if x < {} then'.format(i))
+        lines.append('    f{}(x * 2.0, y) - y  # recurse'.format(i - 1))
+        lines.append('  else')
+        lines.append('    (x + y) * 1.{}'.format(i))
+
+    return '\n'.join(lines)
+
+
+def literals(count):
+    """
+    Generate a source with count definitions heavy in literals.
+    """
+    body = ('x * (1 + 2 * {0}) + 0 - ({0} < 4) * x * 1 + '
+            '(if 1 then x else 0 - x)')
+    return '\n'.join(('def g{0}(x) ' + body).format(i) for i in xrange(count))
+
+
+def shapes(size):
+    """
+    Generate a source with one definition per expression shape, each with
+    about size operators: deep ones nest parentheses, unary operators, calls,
+    right-leaning operators and else-if chains; wide ones chain operators and
+    arguments.
+    """
+    operators = '+-*<'
+    chain = ' '.join('x {}'.format(operators[i % 4]) for i in xrange(size))
+    right = ''.join('x {} ('.format(operators[i % 4]) for i in xrange(size))
+
+    return '\n'.join([
+        'def binary | 5 (x y) x + y',
+        'def parens(x) ' + '(' * size + 'x' + ')' * size,
+        'def negations(x) ' + '-' * size + 'x',
+        'def calls(x) ' + 'parens(' * size + 'x' + ')' * size,
+        'def right(x) ' + right + 'x' + ')' * size,
+        'def elifs(x) ' + 'if x < 1 then x else ' * size + 'x',
+        'def chain(x) ' + chain + ' x',
+        'def user(x) ' + ' | '.join(['x'] * size),
+        'def args(x) f({})'.format(', '.join(['x'] * size))])
+
+
+def trees(size):
+    """
+    Generate a source with one definition per tree shape, each body of about
+    size nodes: nested on the right, chained on the left, nested calls and
+    chained conditionals.
+    """
+    half = size // 2
+
+    return '\n'.join([
+        'def right(x) ' + 'x - (' * half + 'x' + ')' * half,
+        'def left(x) ' + ' * '.join(['x'] * half),
+        'def calls(x) ' + 'calls(' * size + 'x' + ')' * size,
+        'def branches(x) ' + '(if x < 1 then x else x) + ' * (size // 6) +
+        'x'])
+
+
+def synthesize(f, size, definitions=4, block=1 << 16):
+    """
+    Write a source of about size bytes to f, block by block. Each block has a
+    few definitions, each calling the previous one, and a top-level
+    expression, padded with a comment so that a multi-GB source only takes
+    minutes to compile.
+    """
+    f.write('def s0(x y) x + y\n')
+    i = 0
+
+    for _ in xrange(size // block):
+        lines = []
+
+        for i in xrange(i + 1, i + 1 + definitions):
+            lines.append('def s{}(x y) if x < 1 then s{}(x + 1, y) * 0.5 '
+                         'else x + y'.format(i, i - 1))
+
+        lines.append('s{}(0, 1)'.format(i))
+        text = '\n'.join(lines) + '\n'
+        f.write(text + '#' * max(block - len(text) - 1, 0) + '\n')
+
+
+def compile_source(source, context):
+    """
+    Compile every top-level node of a source in context and return the
+    function of the last one. Context.timings counts them.
+    """
+    func = None
+
+    for _, node in context.parse(cStringIO.StringIO(source)):
+        func = context.compile(node)
+
+    return func
+
+
+def report(name, count, unit, elapsed):
+    rate = count / elapsed if elapsed else float('inf')
+    print '{:<16} {:>10} {} {:>8.3f}s {:>14,.0f} {}/s'.format(
+        name, count, unit, elapsed, rate, unit)
+
+
+def bench_lexer(source):
+    expected = None
+
+    for cls in (Lexer, BufferedLexer):
+        start = time.time()
+        tokens = list(cls(cStringIO.StringIO(source)).lex())
+        report(cls.__name__, len(tokens), 'tokens', time.time() - start)
+
+        tokens = [str(token) for token in tokens]
+        if expected is None:
+            expected = tokens
+        elif tokens != expected:
+            msg = '{} token streams differ.'.format(cls.__name__)
+            raise AssertionError(msg)
+
+
+class FreshIdentifier(Identifier):
+    """
+    Tokens as the lexer made them before interning, the baseline of the
+    tokens benchmark: one object with a __dict__ per occurrence. Keywords
+    were already shared.
+    """
+
+
+class FreshNumber(Number):
+    __doc__ = FreshIdentifier.__doc__
+
+
+class FreshChar(object):
+    """
+    A char token compared with strings, as the parser once did.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other
+
+
+def fresh(token, chars=True):
+    """
+    Return a baseline copy of a token, see FreshIdentifier. The parser
+    compares chars by identity: keep them for parsing.
+    """
+    if isinstance(token, Identifier):
+        return FreshIdentifier(token.name)
+
+    if isinstance(token, Number):
+        return FreshNumber(token.value)
+
+    if chars and isinstance(token, Char):
+        return FreshChar(token.value)
+
+    return token
+
+
+def bench_tokens(source):
+    tokens = list(BufferedLexer(cStringIO.StringIO(source)).lex())
+
+    for name, stream in (('fresh', [fresh(token) for token in tokens]),
+                         ('interned', tokens)):
+        # Count each shared token (keywords, chars, identifiers) once.
+        distinct = {id(token): token for token in stream}.values()
+        size = sum(sys.getsizeof(token) + sys.getsizeof(vars(token))
+                   if hasattr(token, '__dict__') else sys.getsizeof(token)
+                   for token in distinct)
+        print '{:<16} {:>10} tokens {:>8} objects {:>12,} bytes'.format(
+            name, len(stream), len(distinct), size)
+
+    for name, stream in (('fresh', [fresh(token, chars=False)
+                                    for token in tokens]),
+                         ('interned', tokens)):
+        start = time.time()
+        items = sum(1 for _ in Parser(iter(stream), Context('bench')).parse())
+        report('Parser ' + name, items, 'items', time.time() - start)
+
+
+def bench_expressions(source):
+    """
+    Parse each definition on its own, to compare the rate of each shape.
+    """
+    context = Context('bench')
+
+    for line in source.splitlines():
+        tokens = list(BufferedLexer(cStringIO.StringIO(line),
+                                    context.symbols).lex())
+        start = time.time()
+
+        for _, node in Parser(iter(tokens), context).parse():
+            # Install the precedence of the binary operators for the next
+            # definitions, without compiling them.
+            if node.prototype.binaryop:
+                opname = node.prototype.opname
+                context.precedence[opname] = node.prototype.precedence
+
+        name = line.split()[1].split('(')[0]
+        report(name, len(tokens), 'tokens', time.time() - start)
+
+
+def bench_codegen(source):
+    # No passes: only code generation, timed by the profiler.
+    context = Context('bench', level=0)
+    context.profile = Profile(context)
+
+    for _, node in context.parse(cStringIO.StringIO(source)):
+        count = 0
+        stack = [node]
+
+        while stack:
+            item = stack.pop()
+            count += isinstance(item, ast.Expression)
+            stack.extend(ast.children(item))
+
+        context.compile(node)
+        elapsed = context.profile.current['phases']['code']
+        report(context.profile.current['name'], count, 'nodes', elapsed)
+
+
+def parse_retained(source, flat):
+    """
+    Parse a source keeping every node, and return the number of expression
+    nodes, the time taken and the growth of the peak RSS, in KB.
+    """
+    context = Context('bench', level=0)
+    context.flat = flat
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    nodes = [node for _, node in context.parse(cStringIO.StringIO(source))]
+    elapsed = time.time() - start
+
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    count = 0
+
+    while nodes:
+        node = nodes.pop()
+        count += isinstance(node, ast.Expression)
+        nodes.extend(ast.children(node))
+
+    return count, elapsed, growth
+
+
+def bench_flat(source):
+    # Each representation is measured in a fresh process.
+    for flat in (False, True):
+        pool = multiprocessing.Pool(1)
+        count, elapsed, growth = pool.apply(parse_retained, (source, flat))
+        pool.close()
+
+        report('flat' if flat else 'objects', count, 'nodes', elapsed)
+        print '{:<16} {:>10,} KB {:>10.1f} bytes/node'.format(
+            '', growth, growth * 1024.0 / count)
+
+
+def bench_stream(source):
+    # A source, or the size of the synthetic source to generate.
+    with tempfile.TemporaryFile() as f:
+        if isinstance(source, str):
+            f.write(source)
+            size = len(source)
+        else:
+            synthesize(f, source)
+            size = f.tell()
+
+        f.seek(0)
+        context = Context('bench')
+        start = time.time()
+        count = 0
+        checkpoint = 0
+        baseline = None
+
+        for _ in stream(f, context):
+            count += 1
+
+            # Report the peak RSS every 1/16th of the source read.
+            if f.tell() >= checkpoint:
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                functions = len(context.functions)
+                print '{:>10,} MB read {:>8} functions {:>10,} KB'.format(
+                    f.tell() >> 20, functions, rss)
+                checkpoint = f.tell() + size // 16
+
+                # Only the machine code and the symbols of the definitions
+                # are kept: the RSS must not grow with the source read.
+                if baseline is None:
+                    baseline = functions, rss
+                elif rss - baseline[1] > (functions - baseline[0]) * \
+                        STREAM_BUDGET:
+                    msg = 'The peak RSS grew to {:,} KB.'.format(rss)
+                    raise AssertionError(msg)
+
+        report('stream', count, 'expressions', time.time() - start)
+
+
+def bench_cache(source):
+    directory = tempfile.mkdtemp()
+
+    try:
+        for name in ('cold', 'warm'):
+            context = Context('bench', Cache(directory))
+
+            start = time.time()
+            compile_source(source, context)
+            count, _ = context.timings[context.pipeline]
+            report(name, count, 'items', time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_batch(source):
+    # Function by function, as the REPL does.
+    context = Context('bench')
+
+    start = time.time()
+    count = 0
+
+    for evaluate, node in context.parse(cStringIO.StringIO(source)):
+        func = context.compile(node)
+
+        if evaluate:
+            context.executor.run_function(func, [])
+            count += 1
+
+    report('per-function', count, 'runs', time.time() - start)
+
+    # Whole module, as run.py does.
+    context = Context('bench', level=3)
+
+    start = time.time()
+    count = 0
+
+    for func in build(cStringIO.StringIO(source), context):
+        context.executor.run_function(func, [])
+        count += 1
+
+    report('whole-module', count, 'runs', time.time() - start)
+
+
+def bench_levels(source):
+    for level in sorted(Context.levels):
+        context = Context('bench', level=level)
+        compile_source(source, context)
+
+        count, elapsed = context.timings[context.pipeline]
+        report(context.pipeline, count, 'items', elapsed)
+
+
+def bench_tiered(source):
+    for tiered in (False, True):
+        context = Context('bench', level=1 if tiered else 2)
+
+        if tiered:
+            context.tiering = Tiering(context)
+
+        toplevel = []
+
+        start = time.time()
+
+        for evaluate, node in context.parse(cStringIO.StringIO(source)):
+            func = context.compile(node)
+
+            if evaluate:
+                toplevel.append(func)
+
+        compiled = time.time()
+
+        # The first round runs the cheap code, the next ones the hot code.
+        for _ in xrange(5):
+            for func in toplevel:
+                context.executor.run_function(func, [])
+
+            if tiered:
+                context.tiering.update()
+
+        print '{:<16} compile {:>8.3f}s run {:>8.3f}s'.format(
+            'tiered' if tiered else context.pipeline, compiled - start,
+            time.time() - compiled)
+
+
+def bench_loops(source):
+    context = Context('bench', level=3)
+    compile_source(source, context)
+
+    count = 10000000
+
+    # Run every plain function of one argument, the number of iterations.
+    for name, symbol in sorted(context.functions.items()):
+        if symbol.arity != 1 or symbol.operator:
+            continue
+
+        native = context.native(symbol.func)
+        start = time.time()
+        native(count)
+        report(name, count, 'iterations', time.time() - start)
+
+
+def bench_types(source):
+    context = Context('bench', level=3)
+    compile_source(source, context)
+
+    # name, argument, amount of work and its unit.
+    workloads = (('fibonacci', 32, 2 * 2178309 - 1, 'calls'),
+                 ('sums', 10 ** 8, 10 ** 8, 'iterations'),
+                 ('pairs', 3000, 3000 ** 2, 'iterations'))
+
+    for name, arg, count, unit in workloads:
+        versions = [context.native(context.functions[version].func)
+                    for version in (name, 'i' + name)]
+
+        # Both versions must compute the same values: check small arguments
+        # first, then the timed one. Doubles round results from 2 ** 53 on,
+        # where ints wrap around from 2 ** 63, eg. sums(10 ** 8).
+        for value in range(30) + [arg]:
+            results = []
+
+            for native in versions:
+                start = time.time()
+                results.append(native(value))
+                elapsed = time.time() - start
+
+                if value == arg:
+                    report(native.name, count, unit, elapsed)
+
+            if abs(results[0]) < 2 ** 53 and results[0] != results[1]:
+                msg = '{}({}) = {}, {}({}) = {}.'.format(
+                    name, value, results[0], 'i' + name, value, results[1])
+                raise AssertionError(msg)
+
+
+def bench_memo(source):
+    for memoized in (True, False):
+        context = Context('bench')
+        names = []
+
+        start = time.time()
+
+        for evaluate, node in context.parse(cStringIO.StringIO(source)):
+            if evaluate:
+                context.evaluate(node)
+                continue
+
+            if isinstance(node, ast.Function):
+                node.memoized = memoized
+                names.append(node.prototype.name)
+
+            context.compile(node)
+
+        print '{:<16} {:>10.6f}s'.format('memo' if memoized else 'plain',
+                                         time.time() - start)
+
+        for name in names if memoized else ():
+            print '  {:<14} {hits} hits, {misses} misses, {evictions} ' \
+                'evictions'.format(name, **stats(context, name))
+
+
+def bench_swap(source):
+    count = 10000000
+
+    for swappable in (False, True):
+        context = Context('bench')
+
+        if swappable:
+            # Recompile everything right away, at the same level: the hot
+            # versions do not count their calls, only the dispatch remains.
+            context.tiering = Tiering(context, threshold=0, level=2)
+
+        # Call the last definition.
+        func = compile_source(source, context)
+
+        if swappable:
+            context.tiering.update()
+
+        native = context.native(func)
+        start = time.time()
+        native(count)
+        report('dispatch' if swappable else 'direct', count, 'calls',
+               time.time() - start)
+
+    # Define every function again, in the live context.
+    definitions = [node for _, node
+                   in context.parse(cStringIO.StringIO(source))]
+
+    start = time.time()
+
+    for node in definitions:
+        func = context.compile(node)
+
+    report('redefine', len(definitions), 'functions', time.time() - start)
+
+    native = context.native(func)
+    start = time.time()
+    native(count)
+    report('redefined', count, 'calls', time.time() - start)
+
+
+def bench_tail(source):
+    for eliminated in (False, True):
+        context = Context('bench')
+
+        if not eliminated:
+            context.set_passes(name for name in context.optimizations
+                               if name != 'tailcallelim')
+
+        compile_source(source, context)
+
+        for name, symbol in sorted(context.functions.items()):
+            func = symbol.func
+            native = context.native(func)
+
+            # A function still calling itself takes a stack frame per call:
+            # stay well below the stack size.
+            recursive = str(func).count('@{}('.format(name)) > 1
+
+            for depth in (10 ** 3, 10 ** 4, 10 ** 6, 10 ** 7):
+                if recursive and depth > 10 ** 4:
+                    break
+
+                args = [depth] + [0] * (native.arity - 1)
+                start = time.time()
+                native(*args)
+                kind = 'calls' if recursive else 'loop'
+                report('{} {} {}'.format(name, kind, depth), depth, 'calls',
+                       time.time() - start)
+
+
+def bench_vectorize(source):
+    context = Context('bench')
+
+    # Evaluate the last definition.
+    func = compile_source(source, context)
+
+    arrays = [numpy.random.random(1000000) for _ in func.args]
+    count = 10000
+
+    start = time.time()
+
+    for i in xrange(count):
+        args = [GenericValue.real(Type.double(), float(array[i]))
+                for array in arrays]
+        context.executor.run_function(func, args)
+
+    report('run_function', count, 'elements', time.time() - start)
+
+    vectorized = Vectorized(context, func)
+
+    start = time.time()
+    vectorized(*arrays)
+    report('Vectorized', arrays[0].size, 'elements', time.time() - start)
+
+    # Vectorizing the function again reuses its wrapper.
+    functions = len(context.module.functions)
+    Vectorized(context, func)
+
+    if len(context.module.functions) > functions:
+        raise AssertionError('The wrapper was generated again.')
+
+
+def bench_native(source):
+    context = Context('bench')
+
+    # Call the last definition.
+    func = compile_source(source, context)
+
+    values = [float(i) for i in xrange(len(func.args))]
+    count = 100000
+
+    start = time.time()
+
+    for _ in xrange(count):
+        args = [GenericValue.real(Type.double(), value) for value in values]
+        context.executor.run_function(func, args).as_real(Type.double())
+
+    report('run_function', count, 'calls', time.time() - start)
+
+    native = context.native(func)
+    start = time.time()
+
+    for _ in xrange(count):
+        native(*values)
+
+    report('NativeFunction', count, 'calls', time.time() - start)
+
+
+def bench_soak(source):
+    context = Context('bench')
+    toplevel = []
+
+    for evaluate, node in context.parse(cStringIO.StringIO(source)):
+        if evaluate:
+            toplevel.append(node)
+        else:
+            context.compile(node)
+
+    # The module size, the compile time and the peak RSS must stay flat. The
+    # first round warms the allocators up, the next ones must not grow.
+    baseline = None
+
+    for _ in xrange(10):
+        start = time.time()
+
+        for i in xrange(10000):
+            try:
+                context.evaluate(toplevel[i % len(toplevel)])
+            except SyntaxError:
+                pass
+
+        elapsed = time.time() - start
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        functions = len(context.module.functions)
+        print '{:>8.1f}us/evaluation {:>6} functions {:>10,} KB'.format(
+            elapsed * 100, functions, rss)
+
+        if baseline is None:
+            baseline = functions, rss
+        elif functions > baseline[0]:
+            msg = 'The module grew to {} functions.'.format(functions)
+            raise AssertionError(msg)
+        elif rss > baseline[1] * 1.1:
+            msg = 'The peak RSS grew to {:,} KB.'.format(rss)
+            raise AssertionError(msg)
+
+
+def bench_functions(source):
+    context = Context('bench')
+
+    # Lookups do not depend on the number of functions already defined: the
+    # time per thousand definitions must stay flat.
+    start = time.time()
+    count = 0
+
+    for _, node in context.parse(cStringIO.StringIO(source)):
+        context.compile(node)
+        count += 1
+
+        if not count % 1000:
+            report('{} defined'.format(count), 1000, 'items',
+                   time.time() - start)
+            start = time.time()
+
+
+def bench_fold(source):
+    for folding in (False, True):
+        # No passes, the IR is what code generation emits.
+        context = Context('bench', level=0)
+        context.folding = folding
+
+        start = time.time()
+        compile_source(source, context)
+        count, _ = context.timings[context.pipeline]
+        report('folded' if folding else 'unfolded', count, 'items',
+               time.time() - start)
+
+        instructions = sum(len(block.instructions)
+                           for func in context.module.functions
+                           for block in func.basic_blocks)
+        print '{:<16} {:>10} instructions'.format('', instructions)
+
+
+def bench_parallel(source):
+    # The definitions do not call each other much: compilation should scale
+    # with the number of workers.
+    for jobs in sorted({1, multiprocessing.cpu_count()}):
+        context = Context('bench', level=3)
+
+        start = time.time()
+        build(cStringIO.StringIO(source), context, jobs)
+        report('{} jobs'.format(jobs), len(context.module.functions),
+               'functions', time.time() - start)
+
+
+def bench_incremental(source):
+    context = Context('bench')
+    incremental = Incremental(context)
+
+    start = time.time()
+    incremental.update(cStringIO.StringIO(source))
+    report('full', len(incremental.recompiled), 'functions',
+           time.time() - start)
+
+    # Editing the last definition only recompiles it.
+    edited = source + ' + 1'
+
+    start = time.time()
+    incremental.update(cStringIO.StringIO(edited))
+    report('edit', len(incremental.recompiled), 'functions',
+           time.time() - start)
+
+
+BENCHMARKS = {'batch': (bench_batch, lambda: FIBONACCI),
+              'cache': (bench_cache, lambda: generate(20000)),
+              'levels': (bench_levels, lambda: generate(5000)),
+              'loops': (bench_loops, lambda: SUMS),
+              'memo': (bench_memo, lambda: MEMOIZED),
+              'codegen': (bench_codegen, lambda: trees(1000000)),
+              'expressions': (bench_expressions, lambda: shapes(100000)),
+              'flat': (bench_flat, lambda: generate(100000)),
+              'fold': (bench_fold, lambda: literals(10000)),
+              'functions': (bench_functions, lambda: generate(10000)),
+              'incremental': (bench_incremental, lambda: generate(5000)),
+              'lexer': (bench_lexer, lambda: generate(20000)),
+              'native': (bench_native, lambda: POLYNOMIAL),
+              'parallel': (bench_parallel, lambda: generate(5000)),
+              'soak': (bench_soak, lambda: SOAK),
+              'stream': (bench_stream, lambda: 2 << 30),
+              'swap': (bench_swap, lambda: LOOP),
+              'tail': (bench_tail, lambda: COUNTDOWN),
+              'tiered': (bench_tiered, lambda: FIBONACCI),
+              'tokens': (bench_tokens, lambda: generate(20000)),
+              'types': (bench_types, lambda: TYPED),
+              'vectorize': (bench_vectorize, lambda: POLYNOMIAL)}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print 'usage: python benchmarks.py {{{}}} [file.k]'.format(
+            ','.join(sorted(BENCHMARKS)))
+        sys.exit(1)
+
+    bench, default = BENCHMARKS[sys.argv[1]]
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            source = f.read()
+    else:
+        source = default()
+
+    bench(source)
+
+
+if __name__ == '__main__':
+    main()
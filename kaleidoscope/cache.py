@@ -0,0 +1,206 @@
+import hashlib
+import os
+import tempfile
+
+from llvm import LLVMException
+from llvm.core import Module
+
+import ast
+
+
+# Bump this whenever code generation changes, to invalidate existing caches.
+VERSION = 5
+
+NODES = (ast.Expression, ast.Function, ast.Prototype)
+
+
+def dependencies(function):
+    """
+    Return the names of the functions called by a function definition.
+    """
+    names = set()
+    stack = [function.body]
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, ast.Call):
+            names.add(node.callee)
+
+        elif isinstance(node, ast.UnaryOperator):
+            names.add(node.name)
+
+        elif isinstance(node, ast.BinaryOperator):
+            if node.operator not in ast.BUILTIN_OPERATORS:
+                names.add(node.name)
+
+        stack.extend(ast.children(node))
+
+    names.discard(function.prototype.name)
+    return names
+
+
+def serialize(node):
+    """
+    Return a string representation of an AST, identical for equal ASTs. The
+    values still to write, and the text between them, are kept on a stack of
+    (text, item) so that deep ASTs are written without recursing.
+    """
+    parts = []
+    stack = [(False, node)]
+
+    while stack:
+        text, item = stack.pop()
+
+        if text:
+            parts.append(item)
+            continue
+
+        if isinstance(item, NODES):
+            fields = [(name + '=', getattr(item, name))
+                      for name in sorted(item.fields)]
+            opening, closing = item.__class__.__name__ + '(', ')'
+
+        elif isinstance(item, dict):
+            fields = [('{!r}: '.format(name), value)
+                      for name, value in sorted(item.items())]
+            opening, closing = '{', '}'
+
+        elif isinstance(item, list):
+            fields = [('', value) for value in item]
+            opening, closing = '[', ']'
+
+        else:
+            parts.append(repr(item))
+            continue
+
+        parts.append(opening)
+        stack.append((True, closing))
+
+        for index in reversed(xrange(len(fields))):
+            prefix, value = fields[index]
+            stack.append((False, value))
+            stack.append((True, (', ' if index else '') + prefix))
+
+    return ''.join(parts)
+
+
+class Cache(object):
+    """
+    On-disk cache of optimized function definitions, stored as bitcode.
+
+    A definition is keyed by a hash of its AST, of the signatures of the
+    functions it calls and of the optimization pipeline. On a hit, the cached
+    module is linked into Context.module instead of being compiled again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.bc')
+
+    def key(self, function, context):
+        passes = ' '.join(map(str, context.optimizations))
+
+        sha = hashlib.sha1()
+        sha.update('version {}\n'.format(VERSION))
+        sha.update('passes {}\n'.format(passes))
+        sha.update(serialize(function))
+
+        # A callee whose signature changes invalidates its callers.
+        for name in sorted(dependencies(function)):
+            symbol = context.functions.get(name)
+            signature = (symbol.types, symbol.result) if symbol else None
+            sha.update('\n{}/{}'.format(name, signature))
+
+        return sha.hexdigest()
+
+    def load(self, key):
+        """
+        Return the cached module of a key, or None. A corrupt entry is removed
+        so that it is built again.
+        """
+        path = self.path(key)
+
+        try:
+            with open(path, 'rb') as f:
+                return Module.from_bitcode(f)
+        except IOError:
+            return None
+        except LLVMException:
+            pass
+
+        # Another session may have removed it already.
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        return None
+
+    def store(self, key, module):
+        # Write to a temporary file of its own first so that a concurrent
+        # session never reads a partial module, nor writes to the same file.
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                module.to_bitcode(f)
+
+            os.rename(temporary, self.path(key))
+        except:
+            os.remove(temporary)
+            raise
+
+    def build(self, function, context):
+        """
+        Compile a function definition in a module of its own.
+        """
+        module, functions, fpm = context.module, context.functions, context.fpm
+        context.module = Module.new(function.prototype.name)
+
+        # Declare the callees; the linker resolves them against the
+        # definitions in the main module.
+        context.functions = {name: ast.declare(context.module, functions[name])
+                             for name in dependencies(function)
+                             if name in functions}
+        context.fpm = context.setup_fpm()
+
+        try:
+            function.code(context)
+            return context.module
+        finally:
+            context.module, context.functions = module, functions
+            context.fpm = fpm
+
+    def compile(self, function, context):
+        prototype = function.prototype
+        symbol = context.functions.get(prototype.name)
+
+        if symbol is not None:
+            if not symbol.func.is_declaration:
+                raise RuntimeError('Redefinition of function.')
+
+            prototype.check(symbol)
+
+        key = self.key(function, context)
+        module = self.load(key)
+
+        if module is None:
+            module = self.build(function, context)
+            self.store(key, module)
+
+        elif prototype.binaryop:
+            # Function.code was skipped, install the operator precedence.
+            context.precedence[prototype.opname] = prototype.precedence
+
+        # Linking may replace an existing declaration, refresh the symbol.
+        context.module.link_in(module)
+        func = context.module.get_function_named(prototype.name)
+        context.functions[prototype.name] = ast.Symbol(func,
+                                                       *prototype.signature)
+        return func
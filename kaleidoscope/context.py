@@ -1,20 +1,87 @@
+import time
+
 from llvm.core import Module
 from llvm.ee import ExecutionEngine
-from llvm.passes import (FunctionPassManager,
-                         PASS_GVN,
-                         PASS_INSTCOMBINE,
-                         PASS_MEM2REG,
-                         PASS_REASSOCIATE,
-                         PASS_SIMPLIFYCFG)
+from llvm.passes import FunctionPassManager, PassManager
+
+import ast
+from ast import declare, Function
+from cache import dependencies
+from flat import Tree
+from fold import Folder
+from lexer import BufferedLexer
+from native import NativeFunction
+from parser import Parser
+from profiler import NULL_PHASE
+from tokens import SymbolTable
+
+
+def locate(nodes, lexer):
+    """
+    Generate the nodes of a parser, setting the lineno and offset of the
+    SyntaxErrors it raises to the position of the last token lexed: the one
+    the parser stopped at.
+    """
+    try:
+        for node in nodes:
+            yield node
+    except SyntaxError as e:
+        if e.lineno is None:
+            e.lineno, e.offset = lexer.position()
+
+        raise
 
 
 class Context(object):
 
-    optimizations = (PASS_MEM2REG,
-                     PASS_INSTCOMBINE,
-                     PASS_REASSOCIATE,
-                     PASS_GVN,
-                     PASS_SIMPLIFYCFG)
+    # Function passes run on each definition as soon as it is compiled, module
+    # passes over the whole module once every definition is known (see
+    # optimize_module).
+    levels = {0: ((), ()),
+              1: (('mem2reg',
+                   'instcombine',
+                   'simplifycfg'),
+                  ('globaldce',)),
+              2: (('mem2reg',
+                   'instcombine',
+                   'reassociate',
+                   'tailcallelim',
+                   'gvn',
+                   'simplifycfg',
+                   'loop-rotate',
+                   'licm',
+                   'indvars'),
+                  ('inline',
+                   'ipsccp',
+                   'deadargelim',
+                   'globaldce',
+                   'instcombine',
+                   'simplifycfg')),
+              3: (('mem2reg',
+                   'instcombine',
+                   'reassociate',
+                   'tailcallelim',
+                   'gvn',
+                   'simplifycfg',
+                   'loop-rotate',
+                   'licm',
+                   'indvars',
+                   'loop-unroll',
+                   'loop-vectorize',
+                   'instcombine'),
+                  ('inline',
+                   'ipsccp',
+                   'deadargelim',
+                   'globalopt',
+                   'globaldce',
+                   'loop-rotate',
+                   'licm',
+                   'indvars',
+                   'loop-unroll',
+                   'loop-deletion',
+                   'instcombine',
+                   'gvn',
+                   'simplifycfg'))}
 
     precedence = {'=': 2,
                   '<': 10,
@@ -23,23 +90,235 @@ class Context(object):
                   '*': 40,
                   '/': 40}
 
-    def __init__(self, name):
+    def __init__(self, name, cache=None, level=2):
         self.name = name
+        self.cache = cache
         self.module = Module.new(name)
         self.builder = None
-        self.scope = {}
+        self.scope = {}  # name -> (alloca, type)
+        self.bindings = {}  # Types of the variables, see ast.Inference
+        self.result = None  # Type returned by the function being generated
+        self.functions = {}  # name -> ast.Symbol
+        self.symbols = SymbolTable()
         self.executor = ExecutionEngine.new(self.module)
+        self.tiering = None
+        self.profile = None
+        self.flat = False  # Parse expressions into flat.Trees
+        self.natives = {}
+        self.folder = Folder()
+
+        # Compile count and time per pipeline.
+        self.timings = {}
+
+        self.set_level(level)
+
+    def set_level(self, level):
+        if level not in self.levels:
+            raise ValueError('Invalid optimization level: {}.'.format(level))
+
+        self.pipeline = 'O{}'.format(level)
+        self.optimizations, self.module_optimizations = self.levels[level]
+        self.folding = level > 0
         self.fpm = self.setup_fpm()
 
-    def setup_fpm(self):
+    def set_passes(self, optimizations, module_optimizations=None):
+        """
+        Use a custom list of function passes and, optionally, module passes.
+        Raise ValueError, leaving the context as it was, if a pass is unknown.
+        """
+        optimizations = tuple(optimizations)
+        fpm = self.setup_fpm(optimizations)
+
+        if module_optimizations is not None:
+            module_optimizations = tuple(module_optimizations)
+            self.add_passes(PassManager.new(), module_optimizations)
+        else:
+            module_optimizations = self.module_optimizations
+
+        self.pipeline = 'custom'
+        self.optimizations = optimizations
+        self.module_optimizations = module_optimizations
+        self.fpm = fpm
+
+    def add_passes(self, pm, optimizations):
+        """
+        Add passes to a pass manager by name, raising ValueError if one is
+        unknown.
+        """
+        for optimization in optimizations:
+            # Depending on the name, llvmpy fails with an LLVMException or
+            # while looking the pass up.
+            try:
+                pm.add(optimization)
+            except Exception:
+                raise ValueError('Unknown pass: {}.'.format(optimization))
+
+    def setup_fpm(self, optimizations=None):
+        if optimizations is None:
+            optimizations = self.optimizations
+
         fpm = FunctionPassManager.new(self.module)
 
         # github.com/llvmpy/llvmpy/issues/44
         fpm.add(self.executor.target_data.clone())
-
-        for optimization in self.optimizations:
-            fpm.add(optimization)
-
+        self.add_passes(fpm, optimizations)
         fpm.initialize()
 
         return fpm
+
+    def timed(self, elapsed, count=1):
+        items, total = self.timings.get(self.pipeline, (0, 0.0))
+        self.timings[self.pipeline] = items + count, total + elapsed
+
+    def optimize_module(self):
+        start = time.time()
+
+        pm = PassManager.new()
+        pm.add(self.executor.target_data.clone())
+        self.add_passes(pm, self.module_optimizations)
+
+        with self.phase('optimize'):
+            pm.run(self.module)
+
+        self.timed(time.time() - start, count=0)
+
+    def phase(self, name, func=None):
+        """
+        Return a context manager timing a phase when profiling, see
+        profiler.Profile.
+        """
+        if self.profile is None:
+            return NULL_PHASE
+
+        return self.profile.phase(name, func)
+
+    def parse(self, stream):
+        """
+        Lex and parse a source, generating (evaluate, node) for each top-level
+        node. Syntax errors are raised with the line and column of the token
+        they were found at.
+        """
+        lexer = BufferedLexer(stream, self.symbols)
+        tokens = lexer.lex()
+
+        if self.profile is not None:
+            tokens = self.profile.lex(tokens)
+
+        nodes = Parser(tokens, self, Tree() if self.flat else ast).parse()
+        nodes = locate(nodes, lexer)
+
+        if self.profile is not None:
+            nodes = self.profile.parse(nodes)
+
+        return nodes
+
+    def compile(self, node):
+        """
+        Generate the code of a top-level node, going through the compilation
+        cache for named function definitions. Tiered definitions are not
+        cached: their dispatch globals must live in Context.module. They can
+        be redefined, see Tiering.redefine, and their operators are never
+        inlined. Definitions instrumented by runtime profiling are not cached
+        either: cached code must be the same in every session.
+        """
+        start = time.time()
+
+        if self.profile is not None:
+            self.profile.item(node)
+
+        if self.folding:
+            with self.phase('fold'):
+                node = self.folder.fold(node)
+
+        runtime = self.profile is not None and self.profile.runtime
+
+        if (self.cache is not None and self.tiering is None and
+                not runtime and isinstance(node, Function) and
+                node.prototype.name):
+            func = self.cache.compile(node, self)
+        elif (self.tiering is not None and isinstance(node, Function) and
+                node.prototype.name in self.tiering.pointers):
+            func = self.tiering.redefine(node)
+        else:
+            func = node.code(self)
+
+        # Callers of a tiered function reach it through its dispatch pointer:
+        # an inlined operator body could not be swapped.
+        if isinstance(node, Function) and self.tiering is None:
+            self.folder.define(node)
+
+        self.timed(time.time() - start)
+        return func
+
+    def address(self, func):
+        """
+        Return the address of the machine code of the current version of func.
+        """
+        if self.tiering is not None and func.name in self.tiering.pointers:
+            return self.tiering.address(func.name)
+
+        return self.executor.get_pointer_to_function(func)
+
+    def evaluate(self, node):
+        """
+        Compile an anonymous top-level function in a scratch module, run it and
+        free it, so that neither the main module nor the JIT code memory grow
+        with each evaluation.
+        """
+        start = time.time()
+
+        if self.profile is not None:
+            self.profile.item(node)
+
+        if self.folding:
+            with self.phase('fold'):
+                node = self.folder.fold(node)
+
+        # The module is added before its declarations are mapped, so that
+        # removing it drops their mappings even if code generation fails.
+        scratch = Module.new('toplevel')
+        self.executor.add_module(scratch)
+        func = None
+
+        try:
+            module, functions = self.module, self.functions
+            self.module, self.functions = scratch, {}
+
+            try:
+                # Declare the callees, bound to their code in the main module.
+                for name in dependencies(node):
+                    if name in functions:
+                        symbol = declare(scratch, functions[name])
+                        address = self.address(functions[name].func)
+                        self.executor.add_global_mapping(symbol.func, address)
+                        self.functions[name] = symbol
+
+                func = node.code(self)
+            finally:
+                self.module, self.functions = module, functions
+
+            self.timed(time.time() - start)
+
+            with self.phase('run'):
+                return NativeFunction(self, func)()
+        finally:
+            if func is not None:
+                self.executor.free_machine_code_for(func)
+
+            # Removing the module also drops the mappings of its globals.
+            self.executor.remove_module(scratch)
+
+    def native(self, func):
+        """
+        Return a NativeFunction calling func, cached by name.
+        """
+        try:
+            return self.natives[func.name]
+        except KeyError:
+            native = NativeFunction(self, func)
+
+            # Anonymous functions all have the same empty name.
+            if func.name:
+                self.natives[func.name] = native
+
+            return native
@@ -0,0 +1,313 @@
+"""
+Flat ASTs: the expressions of a source stored in parallel arrays rather than
+as one object per node.
+
+A Tree is a node factory for the Parser, with the constructors of the ast
+module. Each node is a row made of an opcode and three operands: indices of
+rows, of constants, of interned names, or a slice of the lists of rows used
+by calls, for and var expressions.
+
+The types of annotated var expressions, which are rare, are kept aside by row.
+
+The constructors return views, ast nodes reading and writing their row, which
+folding and code generation use like any other node. Views are built on
+demand and dropped along with the parser's stacks: only the functions and
+their prototypes, one per definition, remain objects.
+"""
+import array
+import collections
+
+import ast
+
+
+NUMBER, VARIABLE, BINARY, UNARY, CALL, IF, FOR, VAR = range(8)
+
+# Operand of a missing node, eg. the step of a for expression.
+NONE = -1
+
+
+def name_property(column):
+    """
+    Return a property for a field stored as an index in tree.names.
+    """
+    def get(self):
+        tree = self.tree
+        return tree.names[getattr(tree, column)[self.index]]
+
+    def set(self, value):
+        getattr(self.tree, column)[self.index] = self.tree.intern(value)
+
+    return property(get, set)
+
+
+def node_property(column):
+    """
+    Return a property for a field stored as a row index.
+    """
+    def get(self):
+        return self.tree.node(getattr(self.tree, column)[self.index])
+
+    def set(self, value):
+        getattr(self.tree, column)[self.index] = self.tree.row(value)
+
+    return property(get, set)
+
+
+def list_property(offset):
+    """
+    Return a property for a field stored in tree.lists, at offset from the
+    start of the slice of the node.
+    """
+    def get(self):
+        tree = self.tree
+        return tree.node(tree.lists[tree.b[self.index] + offset])
+
+    def set(self, value):
+        tree = self.tree
+        tree.lists[tree.b[self.index] + offset] = tree.row(value)
+
+    return property(get, set)
+
+
+class View(object):
+    """
+    Base class of the nodes of a tree, the row index of a node.
+    """
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __reduce__(self):
+        return self.__class__, (self.tree, self.index)
+
+    @property
+    def key(self):
+        # Views are built on each access, their row identifies them.
+        return self.tree, self.index
+
+
+class Number(View, ast.Number):
+    __slots__ = ()
+
+    @property
+    def value(self):
+        return self.tree.constants[self.tree.a[self.index]]
+
+    @value.setter
+    def value(self, value):
+        self.tree.constants[self.tree.a[self.index]] = value
+
+
+class Variable(View, ast.Variable):
+    __slots__ = ()
+
+    name = name_property('a')
+
+
+class BinaryOperator(View, ast.BinaryOperator):
+    __slots__ = ()
+
+    operator = name_property('a')
+    left = node_property('b')
+    right = node_property('c')
+
+
+class UnaryOperator(View, ast.UnaryOperator):
+    __slots__ = ()
+
+    operator = name_property('a')
+    operand = node_property('b')
+
+
+class Call(View, ast.Call):
+    __slots__ = ()
+
+    callee = name_property('a')
+
+    @property
+    def args(self):
+        tree = self.tree
+        start = tree.b[self.index]
+        return map(tree.node, tree.lists[start:start + tree.c[self.index]])
+
+    @args.setter
+    def args(self, args):
+        tree = self.tree
+        tree.b[self.index] = tree.extend(args)
+        tree.c[self.index] = len(args)
+
+
+class If(View, ast.If):
+    __slots__ = ()
+
+    condition = node_property('a')
+    then_branch = node_property('b')
+    else_branch = node_property('c')
+
+
+class For(View, ast.For):
+    __slots__ = ()
+
+    variable = name_property('a')
+    start = list_property(0)
+    end = list_property(1)
+    step = list_property(2)
+    body = list_property(3)
+
+
+class Var(View, ast.Var):
+    """
+    The variables are a copy, in their original order: assign them back to
+    change them.
+    """
+    __slots__ = ()
+
+    body = node_property('c')
+
+    @property
+    def variables(self):
+        tree = self.tree
+        start = tree.a[self.index]
+        rows = tree.lists[start:start + 2 * tree.b[self.index]]
+
+        return collections.OrderedDict(
+            (tree.names[rows[i]], tree.node(rows[i + 1]))
+            for i in xrange(0, len(rows), 2))
+
+    @variables.setter
+    def variables(self, variables):
+        tree = self.tree
+        tree.a[self.index] = tree.pairs(variables)
+        tree.b[self.index] = len(variables)
+
+    @property
+    def types(self):
+        return dict(self.tree.annotations.get(self.index, ()))
+
+    @types.setter
+    def types(self, types):
+        if types:
+            self.tree.annotations[self.index] = dict(types)
+        else:
+            self.tree.annotations.pop(self.index, None)
+
+
+VIEWS = (Number, Variable, BinaryOperator, UnaryOperator, Call, If, For, Var)
+
+
+class Tree(object):
+    """
+    Nodes stored by column: opcodes, operands a, b and c, and the constants,
+    names and lists they refer to.
+    """
+
+    def __init__(self):
+        self.opcodes = array.array('B')
+        self.a = array.array('i')
+        self.b = array.array('i')
+        self.c = array.array('i')
+        self.constants = array.array('d')
+        self.names = []
+        self.interned = {}  # name -> index in names
+        self.lists = array.array('i')
+        self.annotations = {}  # row -> types of an annotated var expression
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def intern(self, name):
+        try:
+            return self.interned[name]
+        except KeyError:
+            self.interned[name] = len(self.names)
+            self.names.append(name)
+            return len(self.names) - 1
+
+    def node(self, index):
+        """
+        Return a view of a row, None for NONE.
+        """
+        if index == NONE:
+            return None
+
+        return VIEWS[self.opcodes[index]](self, index)
+
+    def row(self, node):
+        """
+        Return the row of a node, adding it first if it is not a view of this
+        tree, eg. a node built by the folder.
+        """
+        if node is None:
+            return NONE
+
+        if isinstance(node, View) and node.tree is self:
+            return node.index
+
+        method = getattr(self, node.__class__.__name__)
+        return method(*[getattr(node, field) for field in node.fields]).index
+
+    def extend(self, nodes):
+        """
+        Append the rows of nodes to lists, returning the start of the slice.
+        """
+        rows = [self.row(node) for node in nodes]
+        start = len(self.lists)
+        self.lists.extend(rows)
+        return start
+
+    def pairs(self, variables):
+        """
+        Append the names and initializers of a var expression to lists,
+        returning the start of the slice.
+        """
+        rows = []
+
+        for name, expression in variables.items():
+            rows += self.intern(name), self.row(expression)
+
+        start = len(self.lists)
+        self.lists.extend(rows)
+        return start
+
+    def add(self, opcode, a, b=NONE, c=NONE):
+        self.opcodes.append(opcode)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        return VIEWS[opcode](self, len(self.opcodes) - 1)
+
+    # Constructors, with the signatures of the ast ones.
+
+    def Number(self, value):
+        self.constants.append(value)
+        return self.add(NUMBER, len(self.constants) - 1)
+
+    def Variable(self, name):
+        return self.add(VARIABLE, self.intern(name))
+
+    def BinaryOperator(self, operator, left, right):
+        return self.add(BINARY, self.intern(operator), self.row(left),
+                        self.row(right))
+
+    def UnaryOperator(self, operator, operand):
+        return self.add(UNARY, self.intern(operator), self.row(operand))
+
+    def Call(self, callee, args):
+        return self.add(CALL, self.intern(callee), self.extend(args),
+                        len(args))
+
+    def If(self, condition, then_branch, else_branch=None):
+        return self.add(IF, self.row(condition), self.row(then_branch),
+                        self.row(else_branch))
+
+    def For(self, variable, start, end, step, body):
+        return self.add(FOR, self.intern(variable),
+                        self.extend([start, end, step, body]))
+
+    def Var(self, variables, body, types=None):
+        var = self.add(VAR, self.pairs(variables), len(variables),
+                       self.row(body))
+        var.types = types
+        return var
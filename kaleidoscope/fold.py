@@ -0,0 +1,302 @@
+import operator
+
+import ast
+
+
+# Builtin operators on literals. '<' mirrors FCMP_ULT, true when unordered.
+FOLDS = {'+': operator.add,
+         '-': operator.sub,
+         '*': operator.mul,
+         '<': lambda left, right: 0.0 if left >= right else 1.0}
+
+
+def is_number(node, value):
+    return isinstance(node, ast.Number) and node.value == value
+
+
+def trivial(node, args):
+    """
+    Return whether an operator body only combines its arguments and literals
+    with builtin operators and ifs, so that it can be inlined.
+    """
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, ast.Number):
+            continue
+
+        elif isinstance(node, ast.Variable):
+            if node.name not in args:
+                return False
+
+        elif isinstance(node, ast.BinaryOperator):
+            if node.operator not in FOLDS:
+                return False
+
+            stack += node.left, node.right
+
+        elif isinstance(node, ast.If):
+            if node.else_branch is None:
+                return False
+
+            stack += node.condition, node.then_branch, node.else_branch
+
+        else:
+            return False
+
+    return True
+
+
+def substitute(node, values):
+    """
+    Return a copy of a trivial body with its arguments replaced by values.
+    The copies are built children first, from a stack of (node, visited).
+    """
+    stack = [(node, False)]
+    copies = []
+
+    while stack:
+        node, visited = stack.pop()
+
+        if isinstance(node, ast.Variable):
+            copies.append(values[node.name])
+
+        elif isinstance(node, ast.BinaryOperator):
+            if not visited:
+                stack += (node, True), (node.right, False), (node.left, False)
+                continue
+
+            right, left = copies.pop(), copies.pop()
+            copies.append(ast.BinaryOperator(node.operator, left, right))
+
+        elif isinstance(node, ast.If):
+            if not visited:
+                stack += ((node, True), (node.else_branch, False),
+                          (node.then_branch, False), (node.condition, False))
+                continue
+
+            else_branch, then_branch = copies.pop(), copies.pop()
+            copies.append(ast.If(copies.pop(), then_branch, else_branch))
+
+        else:
+            copies.append(node)
+
+    return copies.pop()
+
+
+class Folded(object):
+    """
+    The node replacing a folded node, yielded last by the fold generators.
+    """
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+
+class Folder(object):
+    """
+    Simplify ASTs between the parser and code generation:
+
+    - fold subtrees made of literals and builtin operators,
+    - drop the dead branch of an if whose condition is a literal,
+    - simplify x * 1, 1 * x and x - 0,
+    - inline the user-defined operators whose body is trivial, when their
+      operands are literals or double arguments, so they can be folded in
+      turn.
+
+    Nodes are simplified in place; fold returns the node replacing its
+    argument.
+    """
+
+    def __init__(self):
+        self.operators = {}  # name -> (args, body)
+
+        # Arguments of the function being folded known to be doubles, those
+        # shadowed by a var or for expression excluded.
+        self.doubles = frozenset()
+
+    def define(self, function):
+        """
+        Remember a compiled function definition, in case it is an operator
+        that can be inlined. Operators on ints or bools are not: their
+        operands would not be converted.
+        """
+        prototype = function.prototype
+
+        if (prototype.operator and prototype.doubles and
+                trivial(function.body, prototype.args)):
+            self.operators[prototype.name] = prototype.args, function.body
+
+    def forget(self, name):
+        """
+        Stop inlining a function whose definition is being replaced.
+        """
+        self.operators.pop(name, None)
+
+    def fold(self, node):
+        """
+        Return the node replacing a simplified node, without recursing: the
+        fold generators of the nodes being folded are kept on a stack, like
+        ast.generate does. Each one yields the children to fold, which are
+        sent back folded, then its replacement as a Folded.
+        """
+        stack = []
+
+        while True:
+            method = getattr(self, 'fold_' + node.__class__.__name__.lower(),
+                             None)
+
+            if method is None:
+                value = node
+            else:
+                stack.append(method(node))
+                value = None
+
+            # Resume the innermost node until it needs another child.
+            while stack:
+                item = stack[-1].send(value)
+
+                if not isinstance(item, Folded):
+                    node = item
+                    break
+
+                stack.pop()
+                value = item.node
+            else:
+                return value
+
+    def inline(self, name, operands):
+        args, body = self.operators[name]
+
+        # Operands are duplicated or dropped along with their arguments:
+        # only inline the ones without side effects. They must be doubles as
+        # well, else the inlined body would not compute in doubles like the
+        # operator: other variables may be ints, see ast.Inference.
+        for operand in operands:
+            if isinstance(operand, ast.Number):
+                continue
+
+            if not (isinstance(operand, ast.Variable) and
+                    operand.name in self.doubles):
+                return None
+
+        return self.fold(substitute(body, dict(zip(args, operands))))
+
+    def fold_function(self, node):
+        prototype = node.prototype
+        doubles = self.doubles
+        self.doubles = frozenset(name for name, type
+                                 in zip(prototype.args, prototype.types)
+                                 if type == ast.DOUBLE)
+
+        node.body = yield node.body
+
+        self.doubles = doubles
+        yield Folded(node)
+
+    def fold_binaryoperator(self, node):
+        node.left = yield node.left
+        node.right = yield node.right
+        yield Folded(self.simplify(node))
+
+    def simplify(self, node):
+        """
+        Return the node replacing a binary operator whose operands are
+        folded.
+        """
+        left, right = node.left, node.right
+
+        if node.operator in FOLDS:
+            if isinstance(left, ast.Number) and isinstance(right, ast.Number):
+                value = FOLDS[node.operator](left.value, right.value)
+                return ast.Number(value)
+
+            if node.operator == '*':
+                if is_number(right, 1):
+                    return left
+                if is_number(left, 1):
+                    return right
+
+            # Not x + 0: it turns -0.0 into 0.0, which externs such as
+            # copysign tell apart. x - 0 keeps the sign.
+            elif node.operator == '-':
+                if is_number(right, 0):
+                    return left
+
+        elif node.name in self.operators:
+            return self.inline(node.name, [left, right]) or node
+
+        return node
+
+    def fold_unaryoperator(self, node):
+        node.operand = yield node.operand
+
+        if node.name in self.operators:
+            yield Folded(self.inline(node.name, [node.operand]) or node)
+        else:
+            yield Folded(node)
+
+    def fold_call(self, node):
+        args = []
+
+        for arg in node.args:
+            args.append((yield arg))
+
+        node.args = args
+        yield Folded(node)
+
+    def fold_if(self, node):
+        node.condition = yield node.condition
+        node.then_branch = yield node.then_branch
+
+        if node.else_branch is not None:
+            node.else_branch = yield node.else_branch
+
+        replacement = node
+
+        # Mirror If.code: FCMP_ONE is false for NaN.
+        if isinstance(node.condition, ast.Number):
+            value = node.condition.value
+
+            if value != 0 and value == value:
+                replacement = node.then_branch
+            elif node.else_branch is not None:
+                replacement = node.else_branch
+
+        yield Folded(replacement)
+
+    def fold_for(self, node):
+        doubles = self.doubles
+        node.start = yield node.start
+
+        # The variable may be an int, see For.counted.
+        self.doubles = doubles - {node.variable}
+        node.end = yield node.end
+
+        if node.step is not None:
+            node.step = yield node.step
+
+        node.body = yield node.body
+
+        self.doubles = doubles
+        yield Folded(node)
+
+    def fold_var(self, node):
+        # The variables of a view of a flat tree are a copy: store them back.
+        variables = node.variables
+        doubles = self.doubles
+
+        for name, expression in variables.items():
+            if expression is not None:
+                variables[name] = yield expression
+
+            self.doubles -= {name}
+
+        node.variables = variables
+        node.body = yield node.body
+
+        self.doubles = doubles
+        yield Folded(node)
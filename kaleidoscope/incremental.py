@@ -0,0 +1,175 @@
+"""
+Incremental rebuilds of a source edited while it runs: each new version of the
+source only recompiles the definitions that changed since the previous one,
+along with their callers.
+
+    python run.py watch ../fibonacci.k
+"""
+import hashlib
+
+from llvm import LLVMException
+
+import ast
+import memo
+from cache import dependencies, serialize
+
+
+class Incremental(object):
+    """
+    Keep Context.module in sync with successive versions of a source.
+
+    Definitions are compared by a hash of their AST, externs by their
+    signature. The machine code of the callers of a changed definition or
+    extern calls the previous version directly, so they are recompiled too;
+    all the other definitions are left untouched.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.hashes = {}  # name -> AST hash of the compiled definition
+        self.callees = {}  # name -> names of the functions it calls
+        self.externs = {}  # name -> signature of the declared extern
+        self.recompiled = []  # names compiled by the last update
+
+    def callers(self, names):
+        """
+        Return names along with the compiled functions calling them, directly
+        or not.
+        """
+        closure = set(names)
+        stack = list(names)
+
+        while stack:
+            name = stack.pop()
+
+            for caller, callees in self.callees.iteritems():
+                if name in callees and caller not in closure:
+                    closure.add(caller)
+                    stack.append(caller)
+
+        return closure
+
+    def discard(self, name):
+        """
+        Free the machine code of a compiled definition and turn it back into a
+        declaration, which its callers keep referring to.
+        """
+        context = self.context
+        func = context.functions[name].func
+
+        context.executor.free_machine_code_for(func)
+        func._ptr.deleteBody()  # Not wrapped by llvm.core.
+
+        # The tables of the previous version are not used anymore either.
+        memo.delete(context, name)
+
+        # Nor is the loop of vectorize.Vectorized, which inlined it.
+        try:
+            wrapper = context.module.get_function_named(name + '.map')
+        except LLVMException:
+            pass
+        else:
+            context.executor.free_machine_code_for(wrapper)
+            wrapper.delete()
+
+        context.natives.pop(name, None)
+        context.folder.forget(name)
+        del self.hashes[name], self.callees[name]
+
+    def delete(self, name):
+        """
+        Delete the declaration of a function nothing calls anymore.
+        """
+        context = self.context
+        func = context.functions.pop(name).func
+
+        # Forget the address the JIT resolved for it, not wrapped by llvm.ee.
+        context.executor._ptr.updateGlobalMapping(func._ptr, 0)
+        func.delete()
+
+    def update(self, stream):
+        """
+        Bring Context.module up to date with a new version of the source and
+        return its top-level expressions, in order.
+        """
+        context = self.context
+        expressions, definitions, externs = [], [], []
+
+        for evaluate, node in context.parse(stream):
+            if evaluate:
+                expressions.append(node)
+
+            elif isinstance(node, ast.Function):
+                # Definitions are compiled once the whole source is parsed,
+                # but the rest of the source may use this operator.
+                if node.prototype.binaryop:
+                    opname = node.prototype.opname
+                    context.precedence[opname] = node.prototype.precedence
+
+                definitions.append(node)
+
+            else:
+                externs.append(node)
+
+        # Hash the definitions before folding rewrites them: a caller does
+        # not depend on the operators inlined in it otherwise.
+        hashes, callees = {}, {}
+
+        for node in definitions:
+            name = node.prototype.name
+            hashes[name] = hashlib.sha1(serialize(node)).hexdigest()
+            callees[name] = dependencies(node)
+
+        # An extern declaring a defined function is part of the definition.
+        signatures = {node.name: node.signature for node in externs
+                      if node.name not in hashes}
+
+        changed = {name for name, digest in hashes.iteritems()
+                   if self.hashes.get(name) != digest}
+        changed |= {name for name, signature in signatures.iteritems()
+                    if self.externs.get(name, signature) != signature}
+        removed = set(self.hashes) - set(hashes)
+        undeclared = set(self.externs) - set(signatures)
+        stale = self.callers(changed | removed | undeclared) & set(self.hashes)
+
+        for name in stale:
+            self.discard(name)
+
+        # The callers of these are all discarded, so nothing uses them.
+        for node in definitions:
+            prototype = node.prototype
+            symbol = context.functions.get(prototype.name)
+
+            if symbol is None or not symbol.func.is_declaration:
+                continue
+
+            if symbol[1:] != prototype.signature:
+                self.delete(prototype.name)
+
+        for name in removed:
+            self.delete(name)
+
+        for name in (changed | undeclared) & set(self.externs):
+            symbol = context.functions.get(name)
+
+            if symbol is not None and symbol.func.is_declaration:
+                self.delete(name)
+
+        for node in externs:
+            if node.name not in context.functions:
+                context.compile(node)
+
+        self.externs = signatures
+
+        self.recompiled = []
+
+        for node in definitions:
+            name = node.prototype.name
+
+            if name in changed or name in stale:
+                context.compile(node)
+                self.hashes[name], self.callees[name] = (hashes[name],
+                                                         callees[name])
+                self.recompiled.append(name)
+
+        return expressions
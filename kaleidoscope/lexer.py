@@ -1,10 +1,15 @@
-from tokens import Char, EOF, Identifier, KEYWORDS, Number
+import cStringIO
+import mmap
+import re
+
+from tokens import Char, EOF, Number, SymbolTable
 
 
 class Lexer(object):
-    def __init__(self, stream):
+    def __init__(self, stream, symbols=None):
         self.current = None
         self.stream = stream
+        self.symbols = SymbolTable() if symbols is None else symbols
 
     def lex(self):
         self.current = self.stream.read(1)
@@ -49,7 +54,7 @@ class Lexer(object):
             self.current = self.stream.read(1)
 
         string = ''.join(chars)
-        return KEYWORDS.get(string, Identifier(string))
+        return self.symbols[string]
 
     def lex_number(self):
         chars = [self.current]
@@ -73,3 +78,106 @@ class Lexer(object):
             self.current = self.stream.read(1)
 
         return None
+
+
+class BufferedLexer(Lexer):
+    """
+    Lexer reading the stream in large chunks and scanning them with a single
+    compiled regex. It yields the same tokens as Lexer, but avoids a read call
+    and a method dispatch per character.
+    """
+
+    # Whitespace and comments are swallowed in front of each token, so every
+    # match yields at most one token. The number alternative mirrors
+    # Lexer.lex_number: a '.' is only accepted right after the first digit.
+    pattern = re.compile(r"""
+        (?:\s+|\#[^\n]*)*
+        (?:
+            ([A-Za-z][A-Za-z0-9]*)          # identifier or keyword
+          | ([0-9](?:\.[0-9]*|[0-9]*))      # number
+          | (.)                             # char
+        )?
+    """, re.DOTALL | re.VERBOSE)
+
+    def __init__(self, stream, symbols=None, chunk_size=1 << 16):
+        super(BufferedLexer, self).__init__(stream, symbols)
+        self.chunk_size = chunk_size
+        self.offset = 0  # offset of the last token in the source
+
+        # The chunk being scanned, its offset and the number of lines before
+        # it, from which position() works out line and column on demand.
+        self.buffer = ''
+        self.base = 0
+        self.lines = 0
+
+    def position(self):
+        """
+        Return the line and column of the last token, both starting at 1.
+        """
+        start = self.offset - self.base
+        line = self.lines + self.buffer.count('\n', 0, start) + 1
+        column = start - self.buffer.rfind('\n', 0, start)
+        return line, column
+
+    def lex(self):
+        finditer = self.pattern.finditer
+        read = self.stream.read
+        symbols = self.symbols
+        buf = ''
+        base = 0  # offset of buf in the source
+        chunk = True
+
+        while chunk:
+            chunk = read(self.chunk_size)
+
+            if chunk:
+                buf += chunk
+
+                # Tokens never span a newline: scan up to the last one and
+                # keep the rest for the next chunk.
+                end = buf.rfind('\n', len(buf) - len(chunk)) + 1
+                if not end:
+                    continue
+            else:
+                end = len(buf)
+
+            self.buffer, self.base = buf, base
+
+            for match in finditer(buf, 0, end):
+                index = match.lastindex
+
+                if index == 1:
+                    token = symbols[match.group(1)]
+
+                elif index == 2:
+                    token = Number(match.group(2))
+
+                elif index == 3:
+                    token = Char(match.group(3))
+
+                else:  # trailing whitespace or comment
+                    continue
+
+                self.offset = base + match.start(index)
+                yield token
+
+            self.lines += buf.count('\n', 0, end)
+            buf = buf[end:]
+            base += end
+
+        self.buffer, self.base = buf, base
+        self.offset = base
+        yield EOF
+
+
+def open_source(path):
+    """
+    Memory-map a source file so that it can be handed to BufferedLexer without
+    being read in memory first. Empty files cannot be mapped, eg. while an
+    editor saves them.
+    """
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return cStringIO.StringIO()
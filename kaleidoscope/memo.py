@@ -0,0 +1,160 @@
+"""
+Memoization of the functions defined with 'memo def', eg.:
+
+    memo def fibonacci(x)
+      if x < 3 then 1 else fibonacci(x - 1) + fibonacci(x - 2)
+
+Only pure functions, whose result depends on their arguments alone, should be
+memoized: calls with the same arguments as a previous one return its result
+without running the body.
+"""
+import ctypes
+
+from llvm import LLVMException
+from llvm.core import Constant, FCMP_OEQ, GlobalVariable, Type
+
+
+# A table has 2 ** BITS entries.
+BITS = 12
+
+# Multiplier of Fibonacci hashing, 2 ** 64 / golden ratio, as a signed integer.
+GOLDEN = 0x9E3779B97F4A7C15 - (1 << 64)
+
+STATS = ('hits', 'misses', 'evictions')
+
+
+class Memo(object):
+    """
+    Code generation of the table of a memoized function.
+
+    The table is direct-mapped: the arguments are hashed to a single entry,
+    holding the arguments and result of the last call stored there. A miss
+    stores its result in the entry, evicting the previous one, so the table
+    never grows. Hits, misses and evictions are counted in globals.
+    """
+
+    def __init__(self, context, func):
+        self.func = func
+        self.index = None
+
+        size = 1 << BITS
+        arity = len(func.args)
+
+        self.keys = self.table(context, 'keys',
+                               Type.array(Type.array(Type.double(), arity),
+                                          size))
+        self.values = self.table(context, 'values',
+                                 Type.array(Type.double(), size))
+        self.used = self.table(context, 'used', Type.array(Type.int(1), size))
+
+        self.counters = {stat: self.table(context, stat, Type.int(64))
+                         for stat in STATS}
+
+    def table(self, context, suffix, ty):
+        name = '{}.memo.{}'.format(self.func.name, suffix)
+        table = GlobalVariable.new(context.module, ty, name)
+        table.initializer = Constant.null(ty)
+        return table
+
+    def count(self, context, stat, amount=None):
+        builder = context.builder
+        counter = self.counters[stat]
+
+        if amount is None:
+            amount = Constant.int(Type.int(64), 1)
+
+        builder.store(builder.add(builder.load(counter), amount), counter)
+
+    def entry(self, builder, table, *indices):
+        int32 = Type.int(32)
+        indices = [Constant.int(int32, 0), self.index] + [
+            Constant.int(int32, index) for index in indices]
+        return builder.gep(table, indices)
+
+    def lookup(self, context):
+        """
+        Return the result of a previous call with the same arguments, if its
+        entry is still in the table. Code generation continues in the block
+        handling a miss.
+        """
+        builder = context.builder
+        int64 = Type.int(64)
+
+        hashed = Constant.int(int64, 0)
+
+        for arg in self.func.args:
+            bits = builder.bitcast(arg, int64)
+            hashed = builder.mul(builder.xor(hashed, bits),
+                                 Constant.int_signed(int64, GOLDEN))
+
+        self.index = builder.lshr(hashed, Constant.int(int64, 64 - BITS))
+
+        hit = builder.load(self.entry(builder, self.used))
+
+        for i, arg in enumerate(self.func.args):
+            key = builder.load(self.entry(builder, self.keys, i))
+            hit = builder.and_(hit, builder.fcmp(FCMP_OEQ, key, arg))
+
+        hit_block = self.func.append_basic_block('memo.hit')
+        miss_block = self.func.append_basic_block('memo.miss')
+        builder.cbranch(hit, hit_block, miss_block)
+
+        builder.position_at_end(hit_block)
+        self.count(context, 'hits')
+        builder.ret(builder.load(self.entry(builder, self.values)))
+
+        builder.position_at_end(miss_block)
+
+    def store(self, context, value):
+        """
+        Store the result of a call in its entry.
+        """
+        builder = context.builder
+        used = self.entry(builder, self.used)
+
+        self.count(context, 'misses')
+        self.count(context, 'evictions',
+                   builder.zext(builder.load(used), Type.int(64)))
+
+        builder.store(Constant.int(Type.int(1), 1), used)
+        builder.store(value, self.entry(builder, self.values))
+
+        for i, arg in enumerate(self.func.args):
+            builder.store(arg, self.entry(builder, self.keys, i))
+
+
+def delete(context, name):
+    """
+    Delete the tables of the function name, if it was memoized, once its
+    machine code is freed.
+    """
+    for suffix in ('keys', 'values', 'used') + STATS:
+        try:
+            table = context.module.get_global_variable_named(
+                '{}.memo.{}'.format(name, suffix))
+        except LLVMException:
+            continue
+
+        # Forget the memory the JIT gave it, not wrapped by llvm.ee.
+        context.executor._ptr.updateGlobalMapping(table._ptr, 0)
+        table.delete()
+
+
+def stats(context, name):
+    """
+    Return the number of hits, misses and evictions of the table of the
+    memoized function name.
+    """
+    values = {}
+
+    for stat in STATS:
+        try:
+            counter = context.module.get_global_variable_named(
+                '{}.memo.{}'.format(name, stat))
+        except LLVMException:
+            raise KeyError(name)
+
+        address = context.executor.get_pointer_to_global(counter)
+        values[stat] = ctypes.c_uint64.from_address(address).value
+
+    return values
@@ -0,0 +1,32 @@
+import ctypes
+
+
+# ctypes types of the arguments and results of compiled functions.
+CTYPES = {'double': ctypes.c_double,
+          'i64': ctypes.c_int64,
+          'i1': ctypes.c_bool}
+
+
+class NativeFunction(object):
+    """
+    Python callable calling a compiled function of doubles, ints and bools
+    through its native address, with ctypes. Calls pay the native call
+    overhead only, instead of the GenericValue marshalling of
+    ExecutionEngine.run_function.
+    """
+
+    def __init__(self, context, func):
+        self.name = func.name
+        self.arity = len(func.args)
+
+        func_type = func.type.pointee
+        args = [CTYPES[str(arg)] for arg in func_type.args]
+        prototype = ctypes.CFUNCTYPE(CTYPES[str(func_type.return_type)], *args)
+        self.native = prototype(context.executor.get_pointer_to_function(func))
+
+    def __call__(self, *args):
+        if len(args) != self.arity:
+            msg = '{}() takes {} arguments ({} given).'
+            raise TypeError(msg.format(self.name, self.arity, len(args)))
+
+        return self.native(*args)
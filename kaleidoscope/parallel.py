@@ -0,0 +1,102 @@
+import cStringIO
+import multiprocessing
+import time
+
+from llvm.core import Function as Func
+from llvm.core import Module
+
+import ast
+from cache import dependencies
+from context import Context
+
+
+def compile_chunk(task):
+    """
+    Compile function definitions in a context of their own and return the
+    bitcode of its module. Runs in a worker process.
+    """
+    definitions, signatures, optimizations = task
+
+    context = Context('chunk')
+    context.set_passes(optimizations)
+
+    # Declare every function the chunk calls, those it defines included:
+    # Prototype.code fills the declarations in.
+    for name, signature in signatures.items():
+        symbol = ast.Symbol(None, *signature)
+        func_type = ast.function_type(symbol.types, symbol.result)
+        func = Func.new(context.module, func_type, name)
+        context.functions[name] = symbol._replace(func=func)
+
+    for definition in definitions:
+        definition.code(context)
+
+    stream = cStringIO.StringIO()
+    context.module.to_bitcode(stream)
+    return stream.getvalue()
+
+
+def compile_definitions(definitions, context, jobs):
+    """
+    Compile function definitions in parallel and link them in context.module.
+
+    Code generation only needs the signatures of the callees, so any function
+    can be compiled independently of the others. The call graph tells which
+    signatures each chunk must declare. Chunks are compiled by jobs worker
+    processes, each in a module of its own, which are then linked together.
+    """
+    # Symbols but their function, see Prototype.signature.
+    signatures = {name: symbol[1:]
+                  for name, symbol in context.functions.items()}
+
+    start = time.time()
+
+    for index, definition in enumerate(definitions):
+        if context.folding:
+            definition = definitions[index] = context.folder.fold(definition)
+
+        prototype = definition.prototype
+        symbol = context.functions.get(prototype.name)
+
+        # The chunks are compiled apart, catch redefinitions beforehand.
+        if prototype.name in signatures and (symbol is None or
+                                             not symbol.func.is_declaration):
+            raise RuntimeError('Redefinition of function.')
+
+        context.folder.define(definition)
+        signatures[prototype.name] = prototype.signature
+
+    # Several chunks per worker even out their running times.
+    size = max(1, len(definitions) // (jobs * 4))
+    tasks = []
+
+    for first in xrange(0, len(definitions), size):
+        chunk = definitions[first:first + size]
+        names = set()
+
+        for definition in chunk:
+            names.add(definition.prototype.name)
+            names.update(dependencies(definition))
+
+        tasks.append((chunk, {name: signatures[name] for name in names
+                              if name in signatures},
+                      context.optimizations))
+
+    pool = multiprocessing.Pool(jobs)
+
+    try:
+        for bitcode in pool.imap(compile_chunk, tasks):
+            module = Module.from_bitcode(cStringIO.StringIO(bitcode))
+            context.module.link_in(module)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Linking replaced the declarations, refresh the symbols.
+    for definition in definitions:
+        prototype = definition.prototype
+        func = context.module.get_function_named(prototype.name)
+        context.functions[prototype.name] = ast.Symbol(func,
+                                                       *prototype.signature)
+
+    context.timed(time.time() - start, len(definitions))
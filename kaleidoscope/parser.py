@@ -2,159 +2,265 @@ import ast
 import tokens
 
 
+# Entries of the operator stack of Parser.parse_expression.
+BINARY = 'binary'
+UNARY = 'unary'
+PAREN = 'paren'
+CALL = 'call'
+IF = 'if'
+FOR = 'for'
+VAR = 'var'
+
+
 class Parser(object):
     """
     Provide a simple token buffer. Parser.current is the current token the
     parser is looking at. Parser.Next() reads another token from the lexer and
     updates Parser.current with its results.
+
+    Expressions are built with the constructors of nodes: the ast module, or
+    a flat.Tree.
     """
 
-    def __init__(self, stream, context):
+    def __init__(self, stream, context, nodes=ast):
         self.stream = stream
         self.context = context
+        self.nodes = nodes
         self.current = None
 
     def next(self):
         self.current = self.stream.next()
 
-    def current_token_precedence(self):
-        if isinstance(self.current, tokens.Char):
-            return self.context.precedence.get(self.current.value, -1)
-        else:
-            return -1
-
-    def parse_number(self):
+    def reduce(self, operands, operators, precedence):
         """
-        numberexpr ::= number
+        Build the pending binary operators of the innermost group that bind at
+        least as tightly as precedence: they are left associative.
         """
-        expression = ast.Number(self.current.value)
-        self.next()
-        return expression
+        nodes = self.nodes
+
+        while operators and operators[-1][0] is BINARY:
+            if operators[-1][2] < precedence:
+                break
+
+            _, operator, _ = operators.pop()
+            right = operands.pop()
+            operands[-1] = nodes.BinaryOperator(operator, operands[-1], right)
 
-    def parse_paren(self):
+    def parse_expression(self):
         """
-        parenexpr ::= '(' expression ')'
+        expression ::= unary (operator unary)*
+        unary ::= primary | unary_operator unary
+        primary ::= identifier | identifier '(' arguments? ')' | number
+                  | '(' expression ')' | ifexpr | forexpr | varexpr
+        arguments ::= expression (',' expression)*
+        ifexpr ::= 'if' expression 'then' expression ('else' expression)?
+        forexpr ::= 'for' identifier '=' expression ',' expression
+                    (',' expression)? 'in' expression
+        varexpr ::= 'var' varnames expression
+
+        Operator precedence parsing with explicit stacks: the depth of the
+        parentheses, calls, unary operators and if, for and var expressions
+        is not bounded by the Python stack. Operands are pushed to operands;
+        pending binary operators, unary operators, parentheses, calls and
+        if, for and var expressions to operators. The entries of the last
+        four collect the subexpressions parsed so far.
         """
-        self.next()
-        expression = self.parse_expression()
+        precedences = self.context.precedence
+        nodes = self.nodes
+        operands = []
+        operators = []
 
-        if self.current != ')':
-            raise SyntaxError("Expected ')'.")
+        while True:
+            # Read an operand, preceded by any number of unary operators and
+            # opening parentheses.
+            current = self.current
+
+            if isinstance(current, tokens.Char):
+                if current is tokens.LPAREN:
+                    operators.append((PAREN,))
+                elif current is tokens.RPAREN:
+                    msg = "Unknown token '{}' when expecting an expression."
+                    raise SyntaxError(msg.format(current))
+                else:
+                    operators.append((UNARY, current.value))
 
-        self.next()
-        return expression
+                self.next()
+                continue
 
-    def parse_identifier(self):
-        """
-        # identifierexpr ::= identifier |
-                             identifier '(' expression? (',' expression)* ')'
-        """
-        name = self.current.name
-        self.next()
+            if isinstance(current, tokens.Identifier):
+                self.next()
 
-        if self.current != '(':
-            return ast.Variable(name)
-        self.next()
+                if self.current is not tokens.LPAREN:
+                    operand = nodes.Variable(current.name)
+                else:
+                    self.next()
 
-        args = []
+                    if self.current is not tokens.RPAREN:
+                        operators.append((CALL, current.name, []))
+                        continue
 
-        if self.current != ')':
-            while True:
-                expression = self.parse_expression()
-                args.append(expression)
+                    self.next()
+                    operand = nodes.Call(current.name, [])
 
-                if self.current == ')':
-                    break
+            elif isinstance(current, tokens.Number):
+                operand = nodes.Number(current.value)
+                self.next()
 
-                if self.current != ',':
-                    msg = "Expected ')' or ',' in argument list"
-                    raise SyntaxError(msg)
+            elif current is tokens.If:
+                self.next()
+                operators.append((IF, []))
+                continue
 
+            elif current is tokens.For:
+                operators.append((FOR, self.parse_for_variable(), []))
+                continue
+
+            elif current is tokens.Var:
                 self.next()
+                variables, types = {}, {}
+                msg = "Expected identifier after 'var'."
+                name = self.parse_var_names(variables, types, msg)
+                operators.append([VAR, variables, types, name])
+                continue
 
-        self.next()
-        return ast.Call(name, args)
+            else:
+                msg = "Unknown token '{}' when expecting an expression."
+                raise SyntaxError(msg.format(current))
 
-    def parse_primary(self):
-        """
-        primaryexpr ::= identifierexpr | numberexpr | parenexpr
-        """
-        if isinstance(self.current, tokens.Identifier):
-            return self.parse_identifier()
+            # Then an operator, or the end of a group, which completes an
+            # operand in turn.
+            while True:
+                # Unary operators apply to the primary right after them.
+                while operators and operators[-1][0] is UNARY:
+                    operand = nodes.UnaryOperator(operators.pop()[1], operand)
+
+                operands.append(operand)
+                current = self.current
+
+                if isinstance(current, tokens.Char):
+                    precedence = precedences.get(current.value, -1)
+                else:
+                    precedence = -1
+
+                # User-defined operators without a precedence are not binary
+                # operators.
+                if precedence is not None and precedence >= 0:
+                    self.reduce(operands, operators, precedence)
+                    operators.append((BINARY, current.value, precedence))
+                    self.next()
+                    break
 
-        elif self.current == tokens.If:
-            return self.parse_if()
+                self.reduce(operands, operators, 0)
+                group = operators[-1][0] if operators else None
 
-        elif self.current == tokens.For:
-            return self.parse_for()
+                if group is PAREN:
+                    if current is not tokens.RPAREN:
+                        raise SyntaxError("Expected ')'.")
 
-        elif isinstance(self.current, tokens.Number):
-            return self.parse_number()
+                    operators.pop()
+                    self.next()
+                    operand = operands.pop()
+                    continue
 
-        elif self.current == tokens.Var:
-            return self.parse_var()
+                if group is CALL:
+                    args = operators[-1][2]
+                    args.append(operands.pop())
 
-        elif self.current == '(':
-            return self.parse_paren()
+                    if current is tokens.RPAREN:
+                        _, name, _ = operators.pop()
+                        self.next()
+                        operand = nodes.Call(name, args)
+                        continue
 
-        else:
-            msg = "Unknown token '{}' when expecting an expression."
-            raise SyntaxError(msg.format(self.current))
+                    if current is not tokens.COMMA:
+                        msg = "Expected ')' or ',' in argument list"
+                        raise SyntaxError(msg)
 
-    def parse_expression(self):
-        """
-        expression ::= unary binoprhs
-        """
-        left = self.parse_unary()
-        return self.parse_binop_right(left, 0)
+                    self.next()
+                    break
 
-    def parse_binop_right(self, left, min_precedence):
-        """
-        binoprhs ::= (operator primary)*
-        """
-        while True:  # If this is a binary operator, find its precedence.
-            precedence = self.current_token_precedence()
+                if group is IF:
+                    branches = operators[-1][1]
+                    branches.append(operands.pop())
 
-            # If this is a binary operator that binds at least as tightly as
-            # the current one, consume it; otherwise we are done.
-            if precedence < min_precedence:
-                return left
+                    if len(branches) == 1:
+                        if current is not tokens.Then:
+                            raise SyntaxError("Expected 'then'.")
 
-            binop = self.current.value
-            self.next()
+                        self.next()
+                        break
 
-            # Parse the unary expression after the binary operator.
-            right = self.parse_unary()
+                    if len(branches) == 2 and current is tokens.Else:
+                        self.next()
+                        break
 
-            # If binary_operator binds less tightly with right than the
-            # operator after right, let the pending operator take right as its
-            # left.
-            next_precedence = self.current_token_precedence()
+                    operators.pop()
+                    operand = nodes.If(*branches)
+                    continue
 
-            if precedence < next_precedence:
-                right = self.parse_binop_right(right, precedence + 1)
+                if group is FOR:
+                    _, variable, parts = operators[-1]
+                    parts.append(operands.pop())
 
-            left = ast.BinaryOperator(binop, left, right)
+                    if len(parts) == 1:
+                        if current is not tokens.COMMA:
+                            msg = "Expected ',' after for start value."
+                            raise SyntaxError(msg)
 
-    def parse_unary(self):
-        """
-        # unary ::= primary | unary_operator unary
-        """
-        # If the current token is not an operator, it must be a primary
-        # expression.
-        if not isinstance(self.current, tokens.Char) or self.current in ('(', ')'):
-            return self.parse_primary()
+                        self.next()
+                        break
 
-        # If this is a unary operator, read it.
-        operator = self.current.value
-        self.next()
-        return ast.UnaryOperator(operator, self.parse_unary())
+                    # The step value is optional.
+                    if len(parts) == 2:
+                        if current is tokens.COMMA:
+                            self.next()
+                            break
+
+                        parts.append(None)
+
+                    if len(parts) == 3:
+                        if current is not tokens.In:
+                            msg = "Expected 'in' after for variable " \
+                                "specification."
+                            raise SyntaxError(msg)
+
+                        self.next()
+                        break
+
+                    operators.pop()
+                    operand = nodes.For(variable, *parts)
+                    continue
+
+                if group is VAR:
+                    _, variables, types, name = operators[-1]
+
+                    # The body once every initializer is read.
+                    if name is None:
+                        operators.pop()
+                        operand = nodes.Var(variables, operands.pop(), types)
+                        continue
+
+                    variables[name] = operands.pop()
+
+                    if self.parse_var_separator():
+                        msg = "Expected identifier after ',' in a var " \
+                            "expression."
+                        name = self.parse_var_names(variables, types, msg)
+                    else:
+                        name = None
+
+                    operators[-1][3] = name
+                    break
+
+                # No group left: the expression ends here.
+                return operands.pop()
 
     def parse_prototype(self):
         """
-        # ::= id '(' id* ')'
-        # ::= binary op number? (id, id)
-        # ::= unary op (id)
+        # ::= id '(' argument* ')' type
+        # ::= binary op number? (argument, argument) type
+        # ::= unary op (argument) type
+        # argument ::= id type
         """
         precedence = None
 
@@ -163,7 +269,7 @@ class Parser(object):
             name = self.current.name
             self.next()
 
-        elif self.current == tokens.Unary:
+        elif self.current is tokens.Unary:
             arity = 1
             self.next()
 
@@ -173,7 +279,7 @@ class Parser(object):
             name = 'unary' + self.current.value
             self.next()
 
-        elif self.current == tokens.Binary:
+        elif self.current is tokens.Binary:
             arity = 2
             self.next()  # eat 'binary'.
 
@@ -194,33 +300,61 @@ class Parser(object):
             msg = "Expected function name, 'unary' or 'binary' in prototype."
             raise SyntaxError(msg)
 
-        if self.current != '(':
+        if self.current is not tokens.LPAREN:
             raise SyntaxError("Expected '(' in prototype.")
         self.next()
 
         args = []
+        types = []
         while isinstance(self.current, tokens.Identifier):
             args.append(self.current.name)
             self.next()
+            types.append(self.parse_type())
 
-        if self.current != ')':
+        if self.current is not tokens.RPAREN:
             raise SyntaxError("Expected ')' in prototype.")
         self.next()
 
+        result = self.parse_type()
+
         if arity and arity != len(args) != 2:
             msg = 'Invalid number of arguments for a {} operator.'
             raise SyntaxError(msg.format('unary' if arity == 1 else 'binary'))
 
-        return ast.Prototype(name, args, arity != 0, precedence)
+        return ast.Prototype(name, args, arity != 0, precedence, types, result)
+
+    def parse_type(self):
+        """
+        type ::= (':' ('int' | 'bool' | 'double'))?
+        """
+        if self.current is not tokens.COLON:
+            return ast.DOUBLE
+        self.next()
+
+        if not (isinstance(self.current, tokens.Identifier) and
+                self.current.name in ast.TYPES):
+            raise SyntaxError("Expected 'int', 'bool' or 'double' after ':'.")
+
+        type = ast.TYPES[self.current.name]
+        self.next()
+        return type
 
     def parse_definition(self):
         """
-        # definition ::= 'def' prototype expression
+        # definition ::= 'memo'? 'def' prototype expression
         """
+        memoized = self.current is tokens.Memo
+
+        if memoized:
+            self.next()
+
+            if self.current is not tokens.Def:
+                raise SyntaxError("Expected 'def' after 'memo'.")
+
         self.next()
         prototype = self.parse_prototype()
         body = self.parse_expression()
-        return ast.Function(prototype, body)
+        return ast.Function(prototype, body, memoized)
 
     def parse_extern(self):
         """
@@ -236,29 +370,12 @@ class Parser(object):
         prototype = ast.Prototype('', [])
         return ast.Function(prototype, self.parse_expression())
 
-    def parse_if(self):
+    def parse_for_variable(self):
         """
-        ifexpr ::= 'if' expression 'then' expression 'else' expression
+        Read the start of a for expression, up to its start value, and return
+        the name of its variable.
         """
         self.next()
-        condition = self.parse_expression()
-
-        if self.current != tokens.Then:
-            raise SyntaxError("Expected 'then'.")
-
-        self.next()
-        then_branch = self.parse_expression()
-
-        if self.current != tokens.Else:
-            return ast.If(condition, then_branch)
-
-        self.next()
-        else_branch = self.parse_expression()
-
-        return ast.If(condition, then_branch, else_branch)
-
-    def parse_for(self):
-        self.next()
 
         if not isinstance(self.current, tokens.Identifier):
             raise SyntaxError("Expected identifier after 'for'.")
@@ -266,75 +383,57 @@ class Parser(object):
         variable = self.current.name
         self.next()
 
-        if self.current != '=':
+        if self.current is not tokens.ASSIGN:
             raise SyntaxError("Expected '=' after for variable.")
         self.next()
 
-        start = self.parse_expression()
-
-        if self.current != ',':
-            raise SyntaxError("Expected ',' after for start value.")
-        self.next()
-
-        end = self.parse_expression()
-
-        # The step value is optional.
-        if self.current == ',':
-            self.next()
-            step = self.parse_expression()
-        else:
-            step = None
-
-        if self.current != tokens.In:
-            msg = "Expected 'in' after for variable specification."
-            raise SyntaxError(msg)
-        self.next()
-
-        body = self.parse_expression()
-        return ast.For(variable, start, end, step, body)
-
-    def parse_var(self):
-        self.next()
-        variables = {}
-
-        # At least one variable name is required.
-        if not isinstance(self.current, tokens.Identifier):
-            raise SyntaxError("Expected identifier after 'var'.")
+        return variable
 
-            # The first part of this code parses the list of identifier/expr
-            # pairs into the local variables list.
+    def parse_var_names(self, variables, types, msg):
+        """
+        varnames ::= identifier type ('=' expression)? (',' varnames | 'in')
 
+        Read the variables of a var expression up to the next initializer and
+        return its name, or up to 'in' and return None, so that the caller
+        parses the body. msg is the error if no identifier comes first.
+        """
         while True:
+            if not isinstance(self.current, tokens.Identifier):
+                raise SyntaxError(msg)
+
             name = self.current.name
             self.next()
 
-            # Read the optional initializer.
-            if self.current == '=':
+            # Read the optional type, the variable keeps it.
+            if self.current is tokens.COLON:
+                types[name] = self.parse_type()
+
+            # The optional initializer is parsed by the caller.
+            if self.current is tokens.ASSIGN:
                 self.next()
-                variables[name] = self.parse_expression()
-            else:
-                variables[name] = None
+                return name
 
-            # End of var list, exit loop.
-            if self.current != ',':
-                break
+            variables[name] = None
 
-            self.next()
+            if not self.parse_var_separator():
+                return None
 
-            if not isinstance(self.current, tokens.Identifier):
-                msg = "Expected identifier after ',' in a var expression."
-                raise SyntaxError(msg)
+            msg = "Expected identifier after ',' in a var expression."
 
-        # Once all the variables are parsed, we then parse the body and create
-        # the AST node:
+    def parse_var_separator(self):
+        """
+        Read the ',' or 'in' after a variable, returning whether another
+        variable follows.
+        """
+        if self.current is tokens.COMMA:
+            self.next()
+            return True
 
-        # At this point, we have to have 'in'.
-        if self.current != tokens.In:
+        if self.current is not tokens.In:
             raise SyntaxError("Expected 'in' keyword after 'var'.")
-        self.next()
 
-        body = self.parse_expression()
-        return ast.Var(variables, body)
+        self.next()
+        return False
 
     def parse(self):
         """
@@ -342,19 +441,16 @@ class Parser(object):
         """
         self.next()
 
-        while self.current != tokens.EOF:
+        while self.current is not tokens.EOF:
 
-            if self.current == tokens.Def:
+            if self.current is tokens.Def or self.current is tokens.Memo:
                 yield False, self.parse_definition()
 
-            elif self.current == tokens.Extern:
+            elif self.current is tokens.Extern:
                 yield False, self.parse_extern()
 
-            elif self.current == tokens.If:
-                yield False, self.parse_if()
-
-            elif self.current == tokens.Var:
-                yield False, self.parse_var()
+            elif self.current is tokens.If or self.current is tokens.Var:
+                yield False, self.parse_expression()
 
             else:
                 yield True, self.parse_toplevel()
@@ -0,0 +1,229 @@
+"""
+Profiling of the compiler and, optionally, of the code it generates.
+
+With Context.profile set, the time spent in each phase is recorded per
+top-level item, along with the number of IR instructions of the definitions
+before and after the function passes. With runtime profiling, compiled
+functions also count their calls and the cycles spent in them.
+"""
+import ctypes
+import json
+import time
+
+from llvm import LLVMException
+from llvm.core import Builder, Constant, GlobalVariable, Type
+from llvm.core import Function as Func
+from llvm.core import INTR_READCYCLECOUNTER
+
+import ast
+
+
+PHASES = ('lex', 'parse', 'fold', 'code', 'verify', 'optimize', 'run')
+
+
+def instructions(func):
+    return sum(len(block.instructions) for block in func.basic_blocks)
+
+
+class NullPhase(object):
+    """
+    Phase of a context without profiling: nothing to measure.
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_PHASE = NullPhase()
+
+
+class Phase(object):
+    """
+    Time a phase of the current item and, given a function, count its
+    instructions before and after.
+    """
+
+    def __init__(self, profile, name, func=None):
+        self.profile = profile
+        self.name = name
+        self.func = func
+
+    def __enter__(self):
+        if self.func is not None:
+            self.before = instructions(self.func)
+
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        item = self.profile.current
+        item['phases'][self.name] += time.time() - self.start
+
+        if self.func is not None:
+            item['instructions'] = [self.before, instructions(self.func)]
+
+
+class Profile(object):
+    """
+    Profile of a context. Lexing and parsing are timed through lex() and
+    parse(), and accounted to the next item.
+    """
+
+    def __init__(self, context, runtime=False):
+        self.context = context
+        self.runtime = runtime
+
+        self.items = []
+        self.named = {}  # name -> item, items of anonymous nodes excluded
+        self.pending = dict.fromkeys(PHASES, 0.0)
+        self.current = None
+        self.counters = {}  # name -> (calls global name, cycles global name)
+
+    def item(self, node):
+        """
+        Start profiling a top-level node, or a run of a compiled function.
+        Nodes and functions with the same name share their item.
+        """
+        if isinstance(node, ast.Function):
+            name = node.prototype.name
+        else:
+            name = getattr(node, 'name', '')
+
+        if name in self.named:
+            self.current = self.named[name]
+        else:
+            self.current = {'name': name,
+                            'phases': dict.fromkeys(PHASES, 0.0),
+                            'instructions': None}
+            self.items.append(self.current)
+
+            if name:
+                self.named[name] = self.current
+
+        for phase, elapsed in self.pending.iteritems():
+            self.current['phases'][phase] += elapsed
+
+        self.pending = dict.fromkeys(PHASES, 0.0)
+
+    def phase(self, name, func=None):
+        # Functions compiled outside of an item, eg. hot versions, are not
+        # accounted.
+        if self.current is None:
+            return NULL_PHASE
+
+        return Phase(self, name, func)
+
+    def lex(self, tokens):
+        """
+        Time a token generator.
+        """
+        while True:
+            start = time.time()
+
+            try:
+                token = next(tokens)
+            except StopIteration:
+                return
+            finally:
+                self.pending['lex'] += time.time() - start
+
+            yield token
+
+    def parse(self, nodes):
+        """
+        Time a node generator, without the lexing it drives.
+        """
+        while True:
+            start, lexing = time.time(), self.pending['lex']
+
+            try:
+                node = next(nodes)
+            except StopIteration:
+                return
+            finally:
+                lexed = self.pending['lex'] - lexing
+                self.pending['parse'] += time.time() - start - lexed
+
+            yield node
+
+    def instrument(self, func):
+        """
+        Make a compiled function count its calls and the cycles spent in them.
+        Cycles include the callees: the cycles of a recursive function are
+        counted once per frame.
+        """
+        module = func.module
+        int64 = Type.int(64)
+        counters = []
+
+        for stat in ('calls', 'cycles'):
+            name = '{}.profile.{}'.format(func.name, stat)
+            counter = GlobalVariable.new(module, int64, name)
+            counter.initializer = Constant.int(int64, 0)
+            counters.append(counter)
+
+        calls, cycles = counters
+        clock = Func.intrinsic(module, INTR_READCYCLECOUNTER, [])
+
+        entry = func.get_entry_basic_block()
+        builder = Builder.new(entry)
+        builder.position_at_beginning(entry)
+
+        start = builder.call(clock, [], 'start')
+        count = builder.add(builder.load(calls), Constant.int(int64, 1))
+        builder.store(count, calls)
+
+        for block in func.basic_blocks:
+            ret = block.terminator
+
+            if ret is None or ret.opcode_name != 'ret':
+                continue
+
+            builder.position_before(ret)
+            elapsed = builder.sub(builder.call(clock, []), start, 'elapsed')
+            builder.store(builder.add(builder.load(cycles), elapsed), cycles)
+
+        self.counters[func.name] = calls.name, cycles.name
+
+    def read(self, name):
+        context = self.context
+
+        try:
+            counter = context.module.get_global_variable_named(name)
+        except LLVMException:
+            return None
+
+        address = context.executor.get_pointer_to_global(counter)
+        return ctypes.c_uint64.from_address(address).value
+
+    def report(self):
+        """
+        Return the profile as a JSON-serializable dict.
+        """
+        totals = dict.fromkeys(PHASES, 0.0)
+        before = after = 0
+
+        for item in self.items:
+            for phase, elapsed in item['phases'].iteritems():
+                totals[phase] += elapsed
+
+            if item['instructions'] is not None:
+                before += item['instructions'][0]
+                after += item['instructions'][1]
+
+        functions = {}
+
+        for name, (calls, cycles) in sorted(self.counters.items()):
+            functions[name] = {'calls': self.read(calls),
+                               'cycles': self.read(cycles)}
+
+        return {'pipeline': self.context.pipeline,
+                'totals': totals,
+                'instructions': [before, after],
+                'items': self.items,
+                'functions': functions}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
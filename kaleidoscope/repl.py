@@ -1,10 +1,42 @@
+import argparse
 import cStringIO
+import inspect
+import sys
 
-from llvm.core import Type
-
+from cache import Cache
 from context import Context
-from lexer import Lexer
-from parser import Parser
+from memo import stats
+from profiler import PHASES, Profile
+from streaming import stream
+from tiering import Tiering
+
+
+class Piped(object):
+    """
+    A piped source, read as a stream up to its next command line: read then
+    returns '' until the command, kept in command, is cleared.
+    """
+
+    def __init__(self, f):
+        self.file = f
+        self.command = None
+
+    def read(self, size):
+        lines = []
+
+        while size > 0 and self.command is None:
+            line = self.file.readline()
+
+            if not line:
+                break
+
+            if line.startswith(':'):
+                self.command = line.strip()
+            else:
+                lines.append(line)
+                size -= len(line)
+
+        return ''.join(lines)
 
 
 def read():
@@ -18,8 +50,167 @@ def read():
     return '\n'.join(lines)
 
 
+def opt(context, level):
+    """
+    :opt LEVEL, use the optimization level LEVEL (0 to 3).
+    """
+    context.set_level(int(level))
+
+
+def passes(context, names):
+    """
+    :passes NAME,..., run these function passes on each definition.
+    """
+    context.set_passes(names.split(','))
+
+
+def timings(context):
+    """
+    :time, report the compile time spent with each pipeline.
+    """
+    for pipeline, (count, total) in sorted(context.timings.items()):
+        average = total / count if count else 0
+        print '{:<8} {:>6} items {:>10.3f}ms {:>10.3f}ms/item'.format(
+            pipeline, count, total * 1000, average * 1000)
+
+
+def memoized(context, name):
+    """
+    :memo NAME, report the hits, misses and evictions of a memoized function.
+    """
+    try:
+        counts = stats(context, name)
+    except KeyError:
+        print "No memoized function named '{}'.".format(name)
+        return
+
+    print '{hits} hits, {misses} misses, {evictions} evictions'.format(
+        **counts)
+
+
+def profile(context, action=None, path=None):
+    """
+    :profile [on|calls|off|json FILE], start profiling, counting calls too,
+    stop, write the profile to FILE or report it.
+    """
+    if action in ('on', 'calls'):
+        context.profile = Profile(context, runtime=action == 'calls')
+        return
+
+    if action == 'off':
+        context.profile = None
+        return
+
+    if context.profile is None:
+        print 'Not profiling.'
+        return
+
+    if action == 'json' and path:
+        context.profile.dump(path)
+        return
+
+    if action is not None:
+        raise ValueError('Unknown action: {}.'.format(action))
+
+    report = context.profile.report()
+
+    for phase in PHASES:
+        elapsed = report['totals'][phase]
+        print '{:<10} {:>10.3f}ms'.format(phase, elapsed * 1000)
+
+    print 'instructions {} -> {}'.format(*report['instructions'])
+
+    for name, counts in sorted(report['functions'].items()):
+        print '{:<16} {calls:>12} calls {cycles:>16} cycles'.format(name,
+                                                                   **counts)
+
+
+COMMANDS = {'memo': memoized,
+            'opt': opt,
+            'passes': passes,
+            'profile': profile,
+            'time': timings}
+
+
+def usage():
+    for _, func in sorted(COMMANDS.items()):
+        print func.__doc__.strip()
+
+
+def command(context, raw):
+    """
+    Run a command line, printing the usage for an unknown command or wrong
+    arguments, and reporting the errors of the command.
+    """
+    args = raw[1:].split()
+    func = COMMANDS.get(args[0]) if args else None
+
+    if func is None:
+        usage()
+        return
+
+    # The context comes first, then the arguments of the command.
+    spec = inspect.getargspec(func)
+    required = len(spec.args) - len(spec.defaults or ())
+
+    if not required <= len(args) <= len(spec.args):
+        usage()
+        return
+
+    try:
+        func(context, *args[1:])
+    except (IOError, ValueError) as e:
+        print 'Error:', e
+
+
 def main():
-    context = Context('repl')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', metavar='DIR',
+                        help='cache compiled definitions in DIR')
+    parser.add_argument('-O', dest='level', type=int,
+                        choices=sorted(Context.levels),
+                        help='optimization level (default: 2, 1 when tiered)')
+    parser.add_argument('--passes', metavar='NAME,...',
+                        help='custom list of function passes')
+    parser.add_argument('--tiered', metavar='CALLS', type=int,
+                        help='recompile functions called CALLS times at O3 '
+                             'and allow redefinitions')
+    args = parser.parse_args()
+
+    if args.level is None:
+        args.level = 1 if args.tiered else 2
+
+    cache = Cache(args.cache) if args.cache else None
+    context = Context('repl', cache, args.level)
+
+    if args.passes:
+        try:
+            context.set_passes(args.passes.split(','))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.tiered:
+        context.tiering = Tiering(context, args.tiered)
+
+    # A piped source is compiled as it is read, however large it is, up to
+    # each command line.
+    if not sys.stdin.isatty():
+        source = Piped(sys.stdin)
+        released = set()
+
+        while True:
+            try:
+                for value in stream(source, context, released):
+                    print value
+            except SyntaxError as e:
+                print 'Error:', e
+                return
+
+            if source.command is None:
+                return
+
+            command(context, source.command)
+            source.command = None
 
     while True:
         try:
@@ -27,19 +218,23 @@ def main():
         except KeyboardInterrupt:
             break
 
-        stream = cStringIO.StringIO(raw)
-        tokens = Lexer(stream).lex()  # returns a generator
-        ast = Parser(tokens, context).parse()  # returns a generator
+        if raw.startswith(':'):
+            command(context, raw)
+            continue
+
+        source = cStringIO.StringIO(raw)
 
-        for evaluate, node in ast:
+        for evaluate, node in context.parse(source):
             try:
-                func = node.code(context)
+                if evaluate:
+                    print context.evaluate(node)
+                else:
+                    context.compile(node)
             except SyntaxError:
                 continue
 
-            if evaluate:
-                res = context.executor.run_function(func, [])
-                print res.as_real(Type.double())
+            if evaluate and context.tiering is not None:
+                context.tiering.update()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,206 @@
+"""
+Compile a whole source file in a single module, optimize it as a whole and
+either run its top-level expressions or print the optimized module:
+
+    python run.py run ../fibonacci.k
+    python run.py compile ../fibonacci.k
+
+or run its top-level expressions again whenever it is saved, only recompiling
+the definitions that changed:
+
+    python run.py watch ../fibonacci.k
+
+or compile and run it item by item, in bounded memory (see streaming.py):
+
+    python run.py stream ../fibonacci.k
+
+With --jobs, function definitions are compiled in parallel worker processes.
+See aot.py to compile a source to an object file or a shared library.
+"""
+import argparse
+import os
+import time
+
+from llvm.core import LINKAGE_INTERNAL
+
+from ast import Function
+from cache import Cache
+from context import Context
+from incremental import Incremental
+from lexer import open_source
+from parallel import compile_definitions
+from profiler import Profile
+from repl import timings
+from streaming import stream
+
+
+def build(stream, context, jobs=1, entry=None):
+    """
+    Compile a source in context.module and return the functions wrapping its
+    top-level expressions, in order. The entry points of the module are these
+    functions or, if given, the functions for which entry(func) is true.
+    Definitions compiled by several jobs are neither cached nor profiled:
+    such contexts are rejected.
+    """
+    if jobs > 1 and (context.cache is not None or
+                     context.profile is not None):
+        raise ValueError('Parallel compilation does not support caching '
+                         'nor profiling.')
+
+    expressions = []
+    definitions = []
+    for evaluate, node in context.parse(stream):
+        if evaluate:
+            # The anonymous functions share the module, tell them apart.
+            node.prototype.name = '__toplevel{}'.format(len(expressions))
+            expressions.append(node)
+
+        elif jobs > 1 and isinstance(node, Function):
+            # The rest of the source may use this operator: install its
+            # precedence now rather than when the definition is compiled.
+            if node.prototype.binaryop:
+                opname = node.prototype.opname
+                context.precedence[opname] = node.prototype.precedence
+
+            definitions.append(node)
+
+        else:
+            context.compile(node)
+
+    if definitions:
+        compile_definitions(definitions, context, jobs)
+
+    toplevel = [context.compile(node) for node in expressions]
+
+    # The other definitions are internal, which lets the interprocedural
+    # passes drop or rewrite them.
+    if entry is None:
+        entries = {func.name for func in toplevel}
+        entry = lambda func: func.name in entries
+
+    for func in context.module.functions:
+        if not func.is_declaration and not entry(func):
+            func.linkage = LINKAGE_INTERNAL
+
+    context.optimize_module()
+    return toplevel
+
+
+def execute(context, toplevel):
+    """
+    Run the functions wrapping top-level expressions, in order, generating
+    their values.
+    """
+    for func in toplevel:
+        if context.profile is not None:
+            context.profile.item(func)
+
+        with context.phase('run'):
+            value = context.native(func)()
+
+        yield value
+
+
+def watch(path, context, report=False):
+    """
+    Run the top-level expressions of a source whenever it is modified.
+    """
+    incremental = Incremental(context)
+    mtime = None
+
+    while True:
+        if os.path.getmtime(path) == mtime:
+            time.sleep(0.2)
+            continue
+
+        mtime = os.path.getmtime(path)
+
+        try:
+            for node in incremental.update(open_source(path)):
+                print context.evaluate(node)
+        except (SyntaxError, RuntimeError) as e:
+            print 'Error:', e
+
+        print '{} recompiled.'.format(len(incremental.recompiled))
+
+        if report:
+            timings(context)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command',
+                        choices=('compile', 'run', 'stream', 'watch'))
+    parser.add_argument('path')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='cache compiled definitions in DIR')
+    parser.add_argument('-O', dest='level', type=int, default=3,
+                        choices=sorted(Context.levels),
+                        help='optimization level')
+    parser.add_argument('--passes', metavar='NAME,...',
+                        help='custom list of function passes')
+    parser.add_argument('--module-passes', metavar='NAME,...',
+                        help='custom list of module passes')
+    parser.add_argument('--time', action='store_true',
+                        help='report the compile time')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write a JSON profile to FILE')
+    parser.add_argument('--profile-calls', action='store_true',
+                        help='profile the calls of the compiled functions')
+    parser.add_argument('--flat', action='store_true',
+                        help='store the expressions in flat arrays')
+    args = parser.parse_args()
+
+    # The worker processes neither go through the cache nor profile.
+    if args.jobs > 1 and (args.cache or args.profile):
+        parser.error('--jobs cannot be combined with --cache or --profile.')
+
+    cache = Cache(args.cache) if args.cache else None
+    context = Context(os.path.basename(args.path), cache, args.level)
+    context.flat = args.flat
+
+    if args.passes or args.module_passes:
+        try:
+            context.set_passes(
+                args.passes.split(',') if args.passes
+                else context.optimizations,
+                args.module_passes.split(',') if args.module_passes else None)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.profile:
+        context.profile = Profile(context, args.profile_calls)
+
+    if args.command == 'watch':
+        return watch(args.path, context, args.time)
+
+    if args.command == 'stream':
+        # Read, rather than map, the source: the mapped pages would count in
+        # the resident memory.
+        with open(args.path, 'rb') as f:
+            for value in stream(f, context):
+                print value
+
+        if args.time:
+            timings(context)
+
+    else:
+        toplevel = build(open_source(args.path), context, args.jobs)
+
+        if args.time:
+            timings(context)
+
+        if args.command == 'compile':
+            print context.module
+        else:
+            for value in execute(context, toplevel):
+                print value
+
+    if args.profile:
+        context.profile.dump(args.profile)
+
+
+if __name__ == '__main__':
+    main()
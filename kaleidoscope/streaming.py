@@ -0,0 +1,70 @@
+"""
+Streaming compilation of sources too large to be held in memory: each
+top-level item is compiled, or run, as soon as it is parsed, then dropped.
+
+    python run.py stream huge.k
+    python repl.py < huge.k
+
+Sources are read in chunks by the lexer. The AST of an item is released once
+its code is emitted, and the IR of a definition once its machine code is:
+memory only grows with the machine code and the symbols of the definitions,
+which later items may call. Unlike run.py compile and run, the module is not
+optimized as a whole. Flat trees (Context.flat) span the whole source: leave
+them off.
+"""
+import sys
+
+from ast import Function
+
+
+def release(context, func):
+    """
+    Emit the machine code of a compiled definition, then delete its IR. The
+    declaration left stays mapped to the machine code, which later callers
+    call.
+    """
+    context.address(func)
+    func._ptr.deleteBody()  # Not wrapped by llvm.core.
+
+
+def stream(source, context, released=None):
+    """
+    Compile the definitions of a source as they are parsed, and run its
+    top-level expressions as they come, generating their values. An item
+    failing to compile is reported on stderr and skipped, as the REPL does;
+    a parse error ends the stream. released holds the names of the
+    definitions released by earlier streams in context.
+    """
+    if released is None:
+        released = set()
+
+    for evaluate, node in context.parse(source):
+        try:
+            if evaluate:
+                value = context.evaluate(node)
+            else:
+                compile_item(context, node, released)
+                continue
+        except (SyntaxError, RuntimeError) as e:
+            print >> sys.stderr, 'Error:', e
+            continue
+
+        yield value
+
+
+def compile_item(context, node, released):
+    if not isinstance(node, Function):
+        context.compile(node)
+        return
+
+    # The machine code of a previous definition cannot be replaced.
+    name = node.prototype.name
+
+    if name in released:
+        raise RuntimeError('Redefinition of function.')
+
+    func = context.compile(node)
+
+    if context.tiering is None:
+        release(context, func)
+        released.add(name)
@@ -0,0 +1,156 @@
+"""
+Benchmark suite: compile and run a corpus of programs, time each phase, and
+compare the results with a baseline. Run it from this directory:
+
+    python suite.py --save baseline.json
+    python suite.py --baseline baseline.json
+
+The corpus is fibonacci.k, the programs of ../corpus and generated sources
+stressing the lexer and the parser. The exit status is 1 when a phase of a
+program is slower than in the baseline by more than the threshold.
+"""
+import argparse
+import cStringIO
+import glob
+import json
+import os
+import sys
+
+from benchmarks import generate
+from context import Context
+from lexer import open_source
+from profiler import PHASES, Profile
+from run import build, execute
+
+
+# Phases faster than this in the baseline are too noisy to compare.
+NOISE = 0.005
+
+
+def corpus():
+    """
+    Return the benchmark programs, as name -> function returning a stream.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    paths = [os.path.join(root, 'fibonacci.k')]
+    paths += sorted(glob.glob(os.path.join(root, 'corpus', '*.k')))
+
+    programs = {os.path.splitext(os.path.basename(path))[0]:
+                (lambda path=path: open_source(path)) for path in paths}
+
+    source = generate(20000)
+    programs['generated'] = lambda: cStringIO.StringIO(source)
+    return programs
+
+
+def measure(stream, level):
+    """
+    Compile and run a program in a new context, returning the time spent in
+    each phase.
+    """
+    context = Context('suite', level=level)
+    context.profile = Profile(context)
+
+    for _ in execute(context, build(stream, context)):
+        pass
+
+    return context.profile.report()['totals']
+
+
+def run(programs, level, repeat):
+    """
+    Return the best time of each phase of each program over repeat runs.
+    """
+    results = {}
+
+    for name, source in sorted(programs.items()):
+        best = None
+
+        for _ in xrange(repeat):
+            totals = measure(source(), level)
+
+            if best is None:
+                best = totals
+            else:
+                best = {phase: min(best[phase], totals[phase])
+                        for phase in PHASES}
+
+        best['total'] = sum(best[phase] for phase in PHASES)
+        results[name] = best
+
+        print '{:<12} {}'.format(name, ' '.join(
+            '{}={:.3f}s'.format(phase, best[phase])
+            for phase in PHASES + ('total',)))
+
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """
+    Return (program, phase, baseline, result) for the phases slower than in
+    the baseline by more than threshold, a ratio.
+    """
+    slower = []
+
+    for name, phases in sorted(results.items()):
+        for phase, elapsed in sorted(phases.items()):
+            before = baseline.get(name, {}).get(phase)
+
+            if before is None or before < NOISE:
+                continue
+
+            if elapsed > before * (1 + threshold):
+                slower.append((name, phase, before, elapsed))
+
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('programs', nargs='*', metavar='NAME',
+                        help='run these programs only')
+    parser.add_argument('-O', dest='level', type=int, default=3,
+                        choices=sorted(Context.levels),
+                        help='optimization level')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='keep the best of REPEAT runs')
+    parser.add_argument('--save', metavar='FILE',
+                        help='write the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare the results with FILE')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown flagged as a regression, as a ratio')
+    args = parser.parse_args()
+
+    programs = corpus()
+
+    if args.programs:
+        programs = {name: programs[name] for name in args.programs}
+
+    results = run(programs, args.level, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'level': args.level, 'results': results}, f, indent=2,
+                      sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline['level'] != args.level:
+            print 'Warning: the baseline was run at -O{}.'.format(
+                baseline['level'])
+
+        slower = regressions(results, baseline['results'], args.threshold)
+
+        for name, phase, before, elapsed in slower:
+            print 'Regression: {} {} {:.3f}s -> {:.3f}s ({:+.0%})'.format(
+                name, phase, before, elapsed, elapsed / before - 1)
+
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
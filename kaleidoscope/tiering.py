@@ -0,0 +1,179 @@
+import ctypes
+
+from llvm.core import Constant, GlobalVariable, Type
+
+import ast
+from native import NativeFunction
+
+
+# Suffix of the name of the optimized version of a function.
+HOT = '.hot'
+
+
+class Tiering(object):
+    """
+    Tiered compilation. Definitions are first compiled with Context.fpm, which
+    should be cheap, and count their calls. Once a function has been called
+    threshold times, update() compiles it again with the hot pipeline.
+
+    Callers reach a function through a dispatch pointer, a global holding the
+    address of its current version: recompiling a function only patches this
+    pointer. Calls already running finish in the old version.
+
+    Redefining a function goes through the same pointer: the new definition
+    is compiled as a version of its own, name.v2, name.v3... then swapped in.
+    Operators are not inlined by the folder while tiering, see
+    Context.compile, so callers always go through the pointer.
+    """
+
+    def __init__(self, context, threshold=1000, level=3):
+        self.context = context
+        self.threshold = threshold
+        self.fpm = context.setup_fpm(context.levels[level][0])
+
+        self.counters = {}  # name -> (current version, call counter)
+        self.pointers = {}  # name -> dispatch pointer
+        self.versions = {}  # version name -> name
+        self.revisions = {}  # name -> number of definitions
+
+    def callee(self, builder, func):
+        current = builder.basic_block.function
+        name = current.name
+
+        if name.endswith(HOT):
+            name = name[:-len(HOT)]
+
+        # A function calls itself directly, whatever its version.
+        if self.versions.get(name, name) == func.name:
+            return current
+
+        pointer = self.pointers.get(func.name)
+
+        # Declarations in scratch modules are already bound to the current
+        # version, see Context.evaluate.
+        if pointer is None or func.is_declaration:
+            return func
+
+        return builder.load(pointer, func.name + '.ptr')
+
+    def address(self, name):
+        """
+        Return the address of the current version of a function.
+        """
+        executor = self.context.executor
+        pointer = executor.get_pointer_to_global(self.pointers[name])
+        return ctypes.c_void_p.from_address(pointer).value
+
+    def instrument(self, function, func):
+        """
+        Make a newly compiled function count its calls and give it a dispatch
+        pointer, unless it is a new version of a function which has one.
+        """
+        version = function.prototype.name
+
+        # Skip anonymous functions, run once, and hot versions.
+        if not version or version.endswith(HOT):
+            return
+
+        module = self.context.module
+        int64 = Type.int(64)
+
+        counter = GlobalVariable.new(module, int64, version + '.calls')
+        counter.initializer = Constant.int(int64, 0)
+
+        name = self.versions.get(version, version)
+
+        if name not in self.pointers:
+            pointer = GlobalVariable.new(module, func.type, name + '.ptr')
+            pointer.initializer = func
+            self.pointers[name] = pointer
+
+        entry = func.get_entry_basic_block()
+        builder = self.context.builder
+        builder.position_at_beginning(entry)
+
+        count = builder.load(counter, 'calls')
+        count = builder.add(count, Constant.int(int64, 1), 'calls')
+        builder.store(count, counter)
+
+        self.counters[name] = function, counter
+
+    def calls(self, name):
+        _, counter = self.counters[name]
+        address = self.context.executor.get_pointer_to_global(counter)
+        return ctypes.c_uint64.from_address(address).value
+
+    def update(self):
+        """
+        Recompile the functions called more than threshold times.
+        """
+        for name, (function, _) in self.counters.items():
+            if self.calls(name) >= self.threshold:
+                del self.counters[name]
+                self.recompile(name, function)
+
+    def recompile(self, name, function):
+        context = self.context
+        prototype = function.prototype
+
+        # The hot version is a plain function, the operator precedence is
+        # already installed.
+        hot = ast.Function(ast.Prototype(prototype.name + HOT, prototype.args,
+                                         types=prototype.types,
+                                         result=prototype.result),
+                           function.body, function.memoized)
+
+        fpm, context.fpm = context.fpm, self.fpm
+
+        try:
+            func = hot.code(context)
+        finally:
+            context.fpm = fpm
+
+        self.swap(name, func)
+
+    def redefine(self, function):
+        """
+        Compile a new definition of a function with a dispatch pointer and
+        swap it in. The previous versions are kept: calls may still be
+        running in them.
+        """
+        context = self.context
+        prototype = function.prototype
+        name = prototype.name
+
+        if name not in self.pointers:
+            raise RuntimeError('Redefinition of function.')
+
+        prototype.check(context.functions[name])
+
+        self.revisions[name] = self.revisions.get(name, 1) + 1
+        version = '{}.v{}'.format(name, self.revisions[name])
+        self.versions[version] = name
+
+        func = ast.Function(ast.Prototype(version, prototype.args,
+                                          types=prototype.types,
+                                          result=prototype.result),
+                            function.body, function.memoized).code(context)
+
+        if prototype.binaryop:
+            context.precedence[prototype.opname] = prototype.precedence
+            context.functions[name] = context.functions[name]._replace(
+                precedence=prototype.precedence)
+
+        self.swap(name, func)
+        return func
+
+    def swap(self, name, func):
+        """
+        Make the dispatch pointer of a function point to func. The pointer is
+        updated with a single aligned store: concurrent callers either call
+        the old version or the new one.
+        """
+        executor = self.context.executor
+        address = executor.get_pointer_to_function(func)
+        pointer = executor.get_pointer_to_global(self.pointers[name])
+        ctypes.c_void_p.from_address(pointer).value = address
+
+        # Later Context.native lookups get the new version as well.
+        self.context.natives[name] = NativeFunction(self.context, func)
@@ -1,4 +1,8 @@
+import string
+
+
 class Keyword(object):
+    __slots__ = ()
 
     @property
     def name(self):
@@ -50,6 +54,12 @@ class _In(Keyword):
 In = _In()
 
 
+class _Memo(Keyword):
+    pass
+
+Memo = _Memo()
+
+
 class _Then(Keyword):
     pass
 
@@ -68,11 +78,12 @@ class _Var(Keyword):
 Var = _Var()
 
 
-KEYWORDS = {k.name: k for k in (Binary, Def, Else, Extern, For, If, In, Then,
-                                Unary, Var)}
+KEYWORDS = {k.name: k for k in (Binary, Def, Else, Extern, For, If, In, Memo,
+                                Then, Unary, Var)}
 
 
 class _EOF(object):
+    __slots__ = ()
 
     def __str__(self):
         return 'EOF'
@@ -81,6 +92,7 @@ EOF = _EOF()
 
 
 class Identifier(object):
+    __slots__ = ('name',)
 
     def __init__(self, name):
         self.name = name
@@ -89,7 +101,23 @@ class Identifier(object):
         return 'identifier \'{}\''.format(self.name)
 
 
+class SymbolTable(dict):
+    """
+    Map a name to its keyword, or to a single Identifier shared by all its
+    occurrences.
+    """
+
+    def __init__(self):
+        super(SymbolTable, self).__init__(KEYWORDS)
+
+    def __missing__(self, name):
+        identifier = self[name] = Identifier(name)
+        return identifier
+
+
 class Number(object):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = float(value)
 
@@ -98,19 +126,49 @@ class Number(object):
 
 
 class Char(object):
-    def __init__(self, value):
-        self.value = value
+    """
+    Chars are singletons: Char(value) always returns the same object for a
+    given value, so they can be compared by identity.
+    """
+    __slots__ = ('value',)
+
+    interned = {}
+
+    def __new__(cls, value):
+        try:
+            return cls.interned[value]
+        except KeyError:
+            char = cls.interned[value] = super(Char, cls).__new__(cls)
+            char.value = value
+            return char
 
     def __eq__(self, other):
-        if isinstance(other, basestring):
+        if self is other:
+            return True
+        elif isinstance(other, basestring):
             return self.value == other
-        elif isinstance(other, Char):
-            return self.value == other.value
         else:
             return False
 
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return hash(self.value)
+
+    def __reduce__(self):
+        # Unpickled chars must be the interned ones too.
+        return Char, (self.value,)
+
     def __str__(self):
         return 'char \'{}\''.format(self.value)
+
+
+for value in string.punctuation:
+    Char(value)
+
+ASSIGN = Char('=')
+COLON = Char(':')
+COMMA = Char(',')
+LPAREN = Char('(')
+RPAREN = Char(')')
@@ -0,0 +1,122 @@
+import ctypes
+
+import numpy
+from llvm import LLVMException
+from llvm.core import Builder, Constant, ICMP_EQ, Type, inline_function
+from llvm.core import Function as Func
+
+
+class Vectorized(object):
+    """
+    Evaluate a compiled double(double, ...) function element-wise over NumPy
+    arrays. A wrapper looping over the contiguous buffers is generated and
+    called once, so there is no Python round-trip per element:
+
+        >>> func = context.module.get_function_named('square')
+        >>> Vectorized(context, func)(numpy.arange(4.0))
+        array([ 0.,  1.,  4.,  9.])
+
+    The function is inlined in the loop, which is then optimized with the
+    passes below, loop vectorization included. A function with a dispatch
+    pointer is called through it instead, see Tiering: its current version
+    is not known until the call. The wrapper is generated once per function.
+    """
+
+    optimizations = ('mem2reg',
+                     'instcombine',
+                     'gvn',
+                     'simplifycfg',
+                     'licm',
+                     'indvars',
+                     'loop-vectorize',
+                     'instcombine')
+
+    def __init__(self, context, func):
+        self.arity = len(func.args)
+
+        if not self.arity:
+            raise ValueError('Cannot vectorize a function without arguments.')
+
+        func_type = func.type.pointee
+
+        if any(str(ty) != 'double'
+               for ty in func_type.args + [func_type.return_type]):
+            raise ValueError('Cannot vectorize a function of ints or bools.')
+
+        try:
+            wrapper = context.module.get_function_named(func.name + '.map')
+        except LLVMException:
+            wrapper = self.build(context, func)
+
+        address = context.executor.get_pointer_to_function(wrapper)
+
+        # out, one buffer per argument and the number of elements.
+        args = (ctypes.c_void_p,) * (self.arity + 1) + (ctypes.c_int64,)
+        self.native = ctypes.CFUNCTYPE(None, *args)(address)
+
+    def build(self, context, func):
+        """
+        Generate void name.map(double *out, double *arg, ..., i64 count).
+        """
+        double_ptr = Type.pointer(Type.double())
+        int64 = Type.int(64)
+        func_args = (double_ptr,) * (self.arity + 1) + (int64,)
+        func_type = Type.function(Type.void(), func_args, False)
+
+        wrapper = Func.new(context.module, func_type, func.name + '.map')
+        out = wrapper.args[0]
+        args = wrapper.args[1:-1]
+        count = wrapper.args[-1]
+
+        entry = wrapper.append_basic_block('entry')
+        loop = wrapper.append_basic_block('loop')
+        after = wrapper.append_basic_block('afterloop')
+
+        builder = Builder.new(entry)
+        zero = Constant.int(int64, 0)
+        empty = builder.icmp(ICMP_EQ, count, zero, 'empty')
+        builder.cbranch(empty, after, loop)
+
+        # out[i] = func(arg[i], ...) for i in [0, count).
+        builder.position_at_end(loop)
+        index = builder.phi(int64, 'i')
+        index.add_incoming(zero, entry)
+
+        values = [builder.load(builder.gep(arg, [index]), 'x') for arg in args]
+        callee = func
+
+        if context.tiering is not None:
+            callee = context.tiering.callee(builder, func)
+
+        call = builder.call(callee, values, 'y')
+        builder.store(call, builder.gep(out, [index]))
+
+        next_index = builder.add(index, Constant.int(int64, 1), 'nexti')
+        index.add_incoming(next_index, loop)
+        done = builder.icmp(ICMP_EQ, next_index, count, 'done')
+        builder.cbranch(done, after, loop)
+
+        builder.position_at_end(after)
+        builder.ret_void()
+
+        if callee is func:
+            inline_function(call)
+
+        wrapper.verify()
+        context.setup_fpm(self.optimizations).run(wrapper)
+
+        return wrapper
+
+    def __call__(self, *arrays):
+        if len(arrays) != self.arity:
+            msg = 'Expected {} arrays, got {}.'
+            raise TypeError(msg.format(self.arity, len(arrays)))
+
+        arrays = [numpy.ascontiguousarray(array, dtype=numpy.float64)
+                  for array in numpy.broadcast_arrays(*arrays)]
+        out = numpy.empty_like(arrays[0])
+
+        buffers = [array.ctypes.data for array in [out] + arrays]
+        self.native(*(buffers + [out.size]))
+
+        return out